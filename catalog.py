@@ -0,0 +1,29 @@
+import argparse
+from time import time
+
+from util.project_catalog import ProjectCatalog
+
+# refreshes the project catalog, only new or changed projects are probed
+parser = argparse.ArgumentParser()
+parser.add_argument("--status", help="list the projects with this status "
+                                     "(no_results, unprocessed, processed)")
+status = parser.parse_args().status
+
+timer = time()
+catalog = ProjectCatalog()
+counts = catalog.refresh()
+catalog.save()
+print('REFRESHED CATALOG %s IN %.2f SECONDS' % (catalog.path, time() - timer))
+print('\t%i new, %i changed, %i removed' %
+      (counts['new'], counts['changed'], counts['removed']))
+
+# summary per status
+n_status = {}
+for project in catalog.projects.values():
+    n_status[project['status']] = n_status.get(project['status'], 0) + 1
+for key in sorted(n_status):
+    print('\t%s: %i' % (key, n_status[key]))
+
+if status is not None:
+    for path in catalog.select(status):
+        print(path)
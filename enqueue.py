@@ -0,0 +1,43 @@
+import argparse
+
+import settings
+from util.project_catalog import ProjectCatalog
+from util.project_postprocessing import get_project_paths
+from util.project_queue import ProjectQueue
+
+# adds projects to the queue of the workers (main.py --queue), either the
+# given paths, the projects with the given status in the catalog, the
+# projects that failed or the projects claimed by workers that were killed
+parser = argparse.ArgumentParser()
+parser.add_argument("paths", nargs='*', help="project paths to add")
+parser.add_argument("--status",
+                    help="add the projects in the catalog with this status "
+                         "(e.g. unprocessed)")
+parser.add_argument("--failed", action='store_true',
+                    help="add the projects that failed again")
+parser.add_argument("--requeue", action='store_true',
+                    help="put back the projects claimed by any worker, "
+                         "only if no workers are running anymore")
+parser.add_argument("--queue", default=settings.Worker.queue,
+                    help="queue file")
+args = parser.parse_args()
+
+queue = ProjectQueue(args.queue)
+if args.requeue:
+    print('PUT BACK %i CLAIMED PROJECTS' % queue.requeue(any_worker=True))
+
+paths = args.paths
+if args.failed:
+    paths = paths + queue.failed()
+elif len(paths) == 0 and not args.requeue:
+    # the catalog is refreshed, such that new projects and changed statuses
+    # are included
+    if args.status is not None:
+        catalog = ProjectCatalog()
+        catalog.refresh()
+        catalog.save()
+    paths = get_project_paths(0, 1, args.status)
+
+queue.put(paths)
+print('ADDED %i PROJECTS TO %s, %i PROJECTS QUEUED' %
+      (len(paths), queue.path, len(queue)))
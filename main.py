@@ -1,7 +1,15 @@
 import argparse
+import signal
+import sys
+import traceback
 from pathlib import Path
-from util.project_postprocessing import get_project_paths, postprocess_project
+from util.buffers import BufferPool
+from util.project_postprocessing import get_project_paths, \
+    postprocess_project, prefetch_projects
+from util.project_queue import ProjectQueue
+from util.heartbeat import Heartbeat
 from util.print import Print
+from util.sample_pool import SamplePool
 from time import time
 import settings
 
@@ -10,41 +18,151 @@ if settings.is_running_on_desktop:
     job_id = 0
     n_jobs = 1
     partition_id = 0
+    dry_run = False
+    stages = None
+    status = None
+    plan = False
+    queue = None
+    worker = None
 else:
     parser = argparse.ArgumentParser()
     parser.add_argument("--job_id", help="id number of the job", type=int)
     parser.add_argument("--n_jobs", help="number of jobs", type=int)
     parser.add_argument("--partition_id", help="server partition id", type=int)
-    job_id = parser.parse_args().job_id
-    n_jobs = parser.parse_args().n_jobs
-    partition_id = parser.parse_args().partition_id
-
-# get project paths which current job should process
-paths_project = get_project_paths(job_id, n_jobs)
-n_projects = len(paths_project)
-
-# post-process each project path
-for idx, path_project in enumerate(paths_project):
-
-    # start timer
-    timer = time()
-
-    # create print object which logs the print messages to a log.txt file
-    path_log = str(Path(path_project).joinpath('log_postprocessing.txt'))
-    print_ = Print(path_log, job_id, n_jobs, partition_id).log
-
-    # log
-    print_('PROCESSING PROJECT (%i/%i) %s...' %
-           (idx + 1, n_projects, path_project))
-
-    # post-process project
-    if settings.is_running_on_desktop:
-        postprocess_project(print_, path_project)
-    else:
-        try:
-            postprocess_project(print_, path_project)
-        except Exception as e:
-            raise type(e)(str(e) + '\nOccurs in file %s' % path_project)
-
-    # log
-    print_('...FINISHED IN %.2f MINUTES' % ((time() - timer)/60))
+    parser.add_argument("--dry_run", action='store_true',
+                        help="only list the stages that would be recomputed")
+    parser.add_argument("--stages", nargs='+',
+                        help="only run these stages (e.g. maps bounds)")
+    parser.add_argument("--status",
+                        help="only process the projects in the catalog with "
+                             "this status (e.g. unprocessed)")
+    parser.add_argument("--plan", action='store_true',
+                        help="process the projects assigned to this job by "
+                             "plan.py")
+    parser.add_argument("--queue", nargs='?', const=settings.Worker.queue,
+                        help="keep taking projects from this queue file "
+                             "(see enqueue.py) until it stays empty")
+    parser.add_argument("--worker",
+                        help="id of the worker that claims the projects of "
+                             "the queue, unique among the running workers "
+                             "(default: partition_id:job_id)")
+    args = parser.parse_args()
+    job_id = args.job_id
+    n_jobs = args.n_jobs
+    partition_id = args.partition_id
+    dry_run = args.dry_run
+    stages = args.stages
+    status = args.status
+    plan = args.plan
+    queue = args.queue
+    worker = args.worker
+
+# get project paths which current job should process, as a worker the
+# projects are taken from the queue (in batches, while it isn't empty)
+if queue is None:
+    batches = [get_project_paths(job_id, n_jobs, status, plan)]
+    n_projects = len(batches[0])
+else:
+    # a worker that restarts first puts back the projects it had claimed,
+    # these are also put back when it fails or is stopped (SIGTERM)
+    if worker is None:
+        worker = '%s:%s' % (partition_id, job_id)
+    queue = ProjectQueue(queue, worker)
+    n_requeued = queue.requeue()
+    if n_requeued != 0:
+        print('PUT BACK %i PROJECTS CLAIMED BY WORKER %s' %
+              (n_requeued, worker))
+    signal.signal(signal.SIGTERM, lambda signum, frame: sys.exit(1))
+    batches = queue.batches()
+    n_projects = len(queue)
+
+# worker processes for the samples, these must be forked before the
+# prefetching threads are started
+pool = SamplePool()
+
+# the large arrays are reused by the projects, such that memory is
+# allocated once for the largest project instead of for each project
+buffer_pool = BufferPool()
+
+# the progress of the job is written to a heartbeat file, see monitor.py
+heartbeat = None
+if not dry_run:
+    heartbeat = Heartbeat(job_id, n_jobs, partition_id, n_projects)
+
+idx = 0
+try:
+    for paths_project in batches:
+
+        # post-process each project path, while the next projects are
+        # prefetched (a dry run doesn't need the inputs of the projects)
+        depth = 0 if dry_run else settings.Prefetch.depth
+        projects = prefetch_projects(paths_project, stages, depth,
+                                     buffer_pool)
+
+        for path_project, project in projects:
+
+            # start timer
+            timer = time()
+
+            # the number of projects of a worker grows with the queue
+            if queue is not None:
+                n_projects = queue.n_taken + len(queue)
+
+            # create print object which logs the print messages to a
+            # log.txt file, a dry run only prints to the console to
+            # preserve the log
+            if dry_run:
+                print_ = print
+            else:
+                path_log = str(
+                    Path(path_project).joinpath('log_postprocessing.txt'))
+                print_ = Print(path_log, job_id, n_jobs, partition_id).log
+
+            # log
+            print_('PROCESSING PROJECT (%i/%i) %s...' %
+                   (idx + 1, n_projects, path_project))
+
+            # post-process project, a worker logs a project that fails and
+            # continues with the next one
+            if heartbeat is not None:
+                heartbeat.start_project(idx, path_project, n_projects)
+            if settings.is_running_on_desktop:
+                postprocess_project(print_, path_project, dry_run, stages,
+                                    project, heartbeat, pool, buffer_pool)
+            elif queue is not None:
+                try:
+                    postprocess_project(print_, path_project, dry_run,
+                                        stages, project, heartbeat, pool,
+                                        buffer_pool)
+                except Exception:
+                    print_('...FAILED, SKIPPING PROJECT %s\n%s' %
+                           (path_project, traceback.format_exc()))
+                    if heartbeat is not None:
+                        heartbeat.end_stage()
+                    queue.done(path_project, failed=True)
+                    idx += 1
+                    continue
+            else:
+                try:
+                    postprocess_project(print_, path_project, dry_run,
+                                        stages, project, heartbeat, pool,
+                                        buffer_pool)
+                except Exception as e:
+                    raise type(e)(str(e) +
+                                  '\nOccurs in file %s' % path_project)
+            if queue is not None:
+                queue.done(path_project)
+
+            # log
+            print_('...FINISHED IN %.2f MINUTES' % ((time() - timer)/60))
+            idx += 1
+finally:
+    # the claimed projects (the processed and prefetched ones) of a worker
+    # that stops early are put back in the queue
+    if queue is not None:
+        queue.requeue()
+
+# mark the job as finished
+pool.close()
+if heartbeat is not None:
+    heartbeat.finish()
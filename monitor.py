@@ -0,0 +1,44 @@
+import argparse
+
+import settings
+from util.heartbeat import aggregate_heartbeats
+
+# prints the progress of all jobs, based on the heartbeat file of each job
+parser = argparse.ArgumentParser()
+parser.add_argument("--root", help="folder containing the heartbeats",
+                    default=settings.Paths.root)
+root = parser.parse_args().root
+
+heartbeats = aggregate_heartbeats(root)
+
+print('%4s %4s %-12s %9s %10s %9s %9s %8s %8s %8s  %s' % (
+    'job', 'part', 'host', 'projects', 'samples', 'samples/s', 'MB',
+    'eta [h]', 'mem [MB]', 'age [s]', 'status'))
+for hb in heartbeats:
+    # current project and stage
+    current = hb['project']
+    if hb['stage'] is not None:
+        current = '%s: %s' % (hb['project'], hb['stage'])
+    if hb['finished']:
+        status = 'finished'
+    elif hb['stalled']:
+        status = 'STALLED (%s)' % current
+    elif hb['slow']:
+        status = 'SLOW (%s)' % current
+    else:
+        status = current
+    eta = '-' if hb['eta_seconds'] is None else '%.1f' % (
+            hb['eta_seconds'] / 3600)
+    memory = '-' if hb['memory_bytes'] is None else '%.0f' % (
+            hb['memory_bytes'] / 2 ** 20)
+    print('%4i %4i %-12s %4i/%-4i %10i %9.1f %9.1f %8s %8s %8.0f  %s' % (
+        hb['job_id'], hb['partition_id'], hb['host'][:12],
+        hb['projects_done'], hb['n_projects'], hb['samples_done'],
+        hb['samples_per_second'], hb['bytes_written'] / 2 ** 20, eta,
+        memory, hb['age_seconds'], status))
+
+n_stalled = sum(hb['stalled'] for hb in heartbeats)
+n_slow = sum(hb['slow'] for hb in heartbeats)
+n_finished = sum(hb['finished'] for hb in heartbeats)
+print('%i jobs: %i finished, %i stalled, %i slow' %
+      (len(heartbeats), n_finished, n_stalled, n_slow))
@@ -0,0 +1,36 @@
+import argparse
+from time import time
+
+import settings
+from util.dataset_shards import JOB_PREFIX, ShardWriter, merge_indices
+from util.project_postprocessing import get_project_paths
+
+# packs the post-processed projects of a job into shards, once all jobs are
+# finished their indices are merged by running this script with --merge and
+# the same --n_jobs
+parser = argparse.ArgumentParser()
+parser.add_argument("--job_id", help="id number of the job", type=int,
+                    default=0)
+parser.add_argument("--n_jobs", help="number of jobs", type=int, default=1)
+parser.add_argument("--merge", help="merge the indices of all jobs",
+                    action='store_true')
+args = parser.parse_args()
+
+if args.merge:
+    path_index = merge_indices(settings.Shards.root, args.n_jobs)
+    print('MERGED SHARD INDICES INTO %s' % path_index)
+
+else:
+    # get project paths which current job should pack
+    paths_project = get_project_paths(args.job_id, args.n_jobs)
+    n_projects = len(paths_project)
+
+    timer = time()
+    writer = ShardWriter(settings.Shards.root, JOB_PREFIX % args.job_id)
+    for idx, path_project in enumerate(paths_project):
+        n = writer.add_project(path_project)
+        print('PACKED PROJECT (%i/%i) %s, %i samples' %
+              (idx + 1, n_projects, path_project, n))
+    writer.close()
+
+    print('...FINISHED IN %.2f MINUTES' % ((time() - timer) / 60))
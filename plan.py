@@ -0,0 +1,76 @@
+import argparse
+from math import ceil
+
+import settings
+from util.cost_model import CostModel, balance
+from util.json_file import write_json
+from util.project_catalog import ProjectCatalog, UNPROCESSED
+
+# proposes the number of jobs, their time/memory requests and a balanced
+# assignment of the projects to the jobs, which is written to
+# settings.Plan.path and used by the jobs if server.sh is run with plan=1
+parser = argparse.ArgumentParser()
+parser.add_argument("--status", default=UNPROCESSED,
+                    help="plan the projects in the catalog with this status "
+                         "(no_results, unprocessed, processed)")
+parser.add_argument("--n_jobs", type=int,
+                    help="number of jobs, by default chosen such that a job "
+                         "takes about settings.Plan.hours_per_job")
+args = parser.parse_args()
+
+# the catalog provides the metadata of the projects
+catalog = ProjectCatalog()
+catalog.refresh()
+catalog.save()
+projects = [project for name, project in sorted(catalog.projects.items())
+            if project['status'] == args.status]
+if len(projects) == 0:
+    raise Exception('ERROR: no projects with status %s' % args.status)
+
+model = CostModel()
+model.fit(catalog)
+print('COST MODEL CALIBRATED ON %i PROCESSED PROJECTS' % model.n_calibration)
+seconds = [model.runtime(project) * settings.Plan.safety
+           for project in projects]
+
+# number of jobs
+n_jobs = args.n_jobs
+if n_jobs is None:
+    n_jobs = ceil(sum(seconds) / (settings.Plan.hours_per_job * 3600))
+n_jobs = max(1, min(n_jobs, settings.Plan.max_jobs, len(projects)))
+
+# balanced assignment, the requests of all jobs are those of the longest
+jobs = []
+for ids in balance(seconds, n_jobs):
+    jobs.append({
+        'seconds': sum(seconds[idx] for idx in ids),
+        'memory': int(model.memory([projects[idx] for idx in ids]) *
+                      settings.Plan.safety),
+        'projects': sorted(projects[idx]['path'] for idx in ids)
+    })
+seconds_job = max(job['seconds'] for job in jobs)
+memory_job = max(job['memory'] for job in jobs)
+seconds_request = ceil(seconds_job)
+time_job = '%i-%02i:%02i:%02i' % (seconds_request // 86400,
+                                  seconds_request % 86400 // 3600,
+                                  seconds_request % 3600 // 60,
+                                  seconds_request % 60)
+mem_job = '%iM' % ceil(memory_job / 2 ** 20)
+
+write_json(settings.Plan.path, {
+    'status': args.status,
+    'n_jobs': n_jobs,
+    'time': time_job,
+    'mem': mem_job,
+    'jobs': jobs
+})
+
+print('PLANNED %i PROJECTS IN %i JOBS, WRITTEN TO %s' %
+      (len(projects), n_jobs, settings.Plan.path))
+print('\testimated total: %.1f hours' % (sum(seconds) / 3600))
+print('\tper job: %.1f-%.1f hours, %.0f MB' % (
+    min(job['seconds'] for job in jobs) / 3600, seconds_job / 3600,
+    memory_job / 2 ** 20))
+print('submit with:\n\ttime=%s mem=%s cpus=%i plan=1 ./server.sh %i '
+      '<partition_id>' % (time_job, mem_job, settings.Parallel.n_workers,
+                          n_jobs))
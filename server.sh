@@ -7,10 +7,18 @@ then
   exit 1
 fi
 
-# verify that only 1 argument is passed
-if [ $# -gt 2 ]
+# the time, memory and cpus of each job can be given as environment
+# variables (time=... mem=... cpus=... ./server.sh ...), see plan.py, with
+# plan=1 the jobs process the projects assigned to them by plan.py, with
+# queue=<file> the jobs keep taking projects from that queue (enqueue.py),
+# the projects of jobs that were killed are put back by the job with the
+# same job_id & partition_id, or by enqueue.py --requeue
+
+# verify that at most 3 arguments are passed, the optional third argument is
+# the catalog status of the projects to process (e.g. unprocessed)
+if [ $# -gt 3 ]
 then
-  echo "ERROR: $# arguments are given, only 1 is required"
+  echo "ERROR: $# arguments are given, at most 3 are allowed"
   exit 1
 fi
 
@@ -28,6 +36,14 @@ then
   exit 1
 fi
 
+# the catalog is refreshed once, before the jobs are submitted, the jobs
+# only read it such that all of them split the same list of projects
+if [ -n "$3" ]
+then
+  source /home/tue/s111167/python-env/postprocess-env/bin/activate
+  python catalog.py || exit 1
+fi
+
 declare -a partitions=("tue.default.q"
                        "elec.default.q"
                        "elec.gpu.q"
@@ -39,11 +55,15 @@ do
   export job_id=$job_id
   export n_jobs=$1
   export partition_id=$2
+  export status=$3
+  export plan=$plan
+  export queue=$queue
   sbatch  --job-name=project_postproceser_$job_id\_$2 \
           --nodes=1 \
           --ntasks=1 \
-          --cpus-per-task=1 \
-          --time=10-00:00:00 \
+          --cpus-per-task=${cpus:-1} \
+          --time=${time:-10-00:00:00} \
+          ${mem:+--mem=$mem} \
           --partition=${partitions[$2]} \
           --output=output_$job_id\_$2 \
           --error=error_$job_id\_$2 \
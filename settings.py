@@ -14,6 +14,48 @@ class Paths:
         root = '/home/tue/s111167/generated_projects'
 
 
+class Catalog:
+    path = Paths.root + '/catalog.json'
+
+
+class Heartbeat:
+    interval = 30  # minimum number of seconds between heartbeat updates
+    stalled = 1800  # a job without update for this many seconds is stalled
+    slow = 0.5  # a job slower than this fraction of the median is slow
+
+
+class Parallel:
+    n_workers = 1  # number of processes that generate the samples
+    block_size = 100  # number of samples per task of a worker
+
+
+class Worker:
+    queue = Paths.root + '/queue.txt'  # project paths, see enqueue.py
+    poll = 10  # seconds between checks of an empty queue
+    idle = 600  # seconds a worker waits for new projects before it stops
+
+
+class Prefetch:
+    depth = 1  # number of upcoming projects that are loaded in advance
+
+
+class Plan:
+    path = Paths.root + '/plan.json'
+    hours_per_job = 24  # targeted runtime of a single job
+    max_jobs = 200  # maximum number of jobs that is proposed
+    safety = 1.5  # factor applied to the estimated time and memory
+    n_calibration = 200  # processed projects used to calibrate the model
+    # rough defaults of the runtime model, used until enough projects are
+    # processed to calibrate it
+    seconds_base = 10.  # per project
+    seconds_per_sample = 5e-4  # per msf sample and antenna
+    seconds_per_csv_byte = 1e-7  # reading the e-field csv files
+    seconds_per_cell = 1e-6  # interpolation, per source grid cell & antenna
+    seconds_per_entity = 1e-3  # drawing the dxf maps
+    memory_base = 2 ** 30  # bytes, python & libraries of the main process
+    memory_worker = 2 ** 29  # bytes, each sample worker (Parallel.n_workers)
+
+
 class Img:
     width = 32
     height = width
@@ -32,6 +74,17 @@ class SAR:
     db_min = -60
 
 
+class CFA:
+    chunk_size = 100000  # number of csv rows that are parsed at once
+    # number of e-fields of a project that are read at once. Each thread
+    # holds the source grid of its e-field until it is interpolated, and
+    # the prefetched projects are read at the same time as the processed
+    # one, so up to n_threads * (Prefetch.depth + 1) source grids are in
+    # memory. More threads only pay off if the job has a cpu per thread
+    # and the storage keeps up, on single cpu jobs 1 or 2 is enough.
+    n_threads = 2
+
+
 class DXF:
     background = array([250., 206., 135.])  # BLUE, GREEN, RED
     n_arc = 1000  # number of points used to approximate an arc
@@ -41,3 +94,12 @@ class DXF:
     per0 = 80
     con0 = 0
     den0 = 0
+
+
+class Shards:
+    if is_running_on_desktop:
+        root = 'C:/Users/Dennis/Documents/generated_shards'
+    else:
+        root = '/home/tue/s111167/generated_shards'
+    samples_per_shard = 8192
+    max_antennas = 32  # phases/amplitudes are zero-padded up to this length
@@ -0,0 +1,60 @@
+from threading import Lock
+
+import numpy as np
+
+
+class Buffers:
+    """
+    Arrays that are reused by the projects processed one after another,
+    such that a long running job doesn't allocate (and page in) the large
+    arrays of every project again. Each array only grows, to the largest
+    size requested so far (e.g. the largest number of antennas).
+
+    The arrays returned by zeros are views of these buffers, they must not
+    be used once the next project requested the same array.
+    """
+
+    def __init__(self):
+        self._arrays = {}
+
+    def zeros(self, name: str, shape: tuple, dtype=np.float64) -> np.ndarray:
+        """
+        contiguous array of zeros with the given shape, in the buffer name
+        """
+        size = int(np.prod(shape))
+        array = self._arrays.get(name)
+        if array is None or array.dtype != dtype or len(array) < size:
+            array = np.empty(size, dtype)
+            self._arrays[name] = array
+        array = array[:size].reshape(shape)
+        array[...] = 0
+        return array
+
+
+class BufferPool:
+    """
+    Buffers for the projects that are held at once (the processed project
+    and the prefetched ones), each project acquires its own buffers and
+    releases them once it is processed
+    """
+
+    def __init__(self):
+        self._free = []
+        self._lock = Lock()
+
+    def acquire(self) -> Buffers:
+        with self._lock:
+            if len(self._free) != 0:
+                return self._free.pop()
+        return Buffers()
+
+    def release(self, buffers: Buffers) -> None:
+        with self._lock:
+            self._free.append(buffers)
+
+
+def zeros(buffers: Buffers, name: str, shape: tuple, dtype=np.float64):
+    # zeros from the buffers, if any
+    if buffers is None:
+        return np.zeros(shape, dtype)
+    return buffers.zeros(name, shape, dtype)
@@ -1,8 +1,13 @@
+from concurrent.futures import ThreadPoolExecutor, as_completed
+from pathlib import Path
+from threading import Lock
+
 import numpy as np
 import pandas as pd
 import scipy.interpolate
 
 import settings
+from .buffers import Buffers, zeros
 
 REAL = 0
 IMAG = 1
@@ -14,6 +19,8 @@ COMPLEX = 2
 LABELS = [['ExRe [V/m]', 'ExIm [V/m]'],
           ['EyRe [V/m]', 'EyIm [V/m]'],
           ['EzRe [V/m]', 'EzIm [V/m]']]
+LABEL_X = '#x [mm]'
+LABEL_Z = 'z [mm]'
 
 
 class ComplexFieldPerAntenna:
@@ -22,9 +29,16 @@ class ComplexFieldPerAntenna:
     interpolates it to the Img.width and Img.height resolution as defined in
     the settings file. Furthermore, the meshgrid points (xx, zz), unique
     points (x, z), and pixel-size (mm_per_px) are also determined.
+
+    The e-fields of settings.CFA.n_threads antennas are read and
+    interpolated at once, each into its own slot of cfa. The interpolation
+    points are determined by the e-field that is read first, all e-fields
+    must be exported on the same grid.
+
+    If buffers are given, cfa is placed in these (reused) buffers.
     """
 
-    def __init__(self, path_project):
+    def __init__(self, path_project, buffers: Buffers = None):
 
         # get e-fields in project folder
         paths_efield = sorted(list(path_project.glob('e-field*.csv')))
@@ -33,33 +47,28 @@ class ComplexFieldPerAntenna:
         self.na = len(paths_efield)
 
         # pre-allocate space for cfa
-        self.cfa = np.zeros((
+        self.cfa = zeros(buffers, 'cfa', (
             settings.Img.width * settings.Img.height,
             self.na,
             XYZ,
             COMPLEX
         ))
 
-        # loop through exported e-field per antenna
-        points_old, points_new, size_old = None, None, None
-        for idx, path_efield in enumerate(paths_efield):
-
-            # read e-field into a pandas DataFrame
-            data = pd.read_csv(path_efield, delimiter=';')
-
-            # determine interpolation points
-            if idx == 0:
-                points_old, points_new, size_old = \
-                    _interpolation_points(data)
-
-            # interpolate data to desired resolution
-            for dim in range(XYZ):
-                for unit in range(COMPLEX):
-                    self.cfa[:, idx, dim, unit] = _interpolate(
-                        data[LABELS[dim][unit]].values.reshape(size_old),
-                        points_old,
-                        points_new
-                    )
+        # load the exported e-field per antenna concurrently, reading is
+        # mostly waiting for the storage
+        grid = _SharedGrid()
+        with ThreadPoolExecutor(settings.CFA.n_threads) as executor:
+            futures = [executor.submit(self._load, idx, path_efield, grid)
+                       for idx, path_efield in enumerate(paths_efield)]
+            try:
+                for future in as_completed(futures):
+                    future.result()
+            except Exception:
+                # don't start reading the other e-fields
+                for future in futures:
+                    future.cancel()
+                raise
+        points_new = grid.points[1]
 
         # set attributes
         self.xx = points_new[0]
@@ -70,18 +79,198 @@ class ComplexFieldPerAntenna:
         self.mm_per_px = [self.x[1] - self.x[0],
                           self.z[1] - self.z[0]]
 
+    def _load(self, idx: int, path_efield: Path, grid) -> None:
+
+        # stream the e-field onto its source grid
+        efield = _SourceGrid(path_efield)
+
+        # determine interpolation points
+        points_old, points_new, _ = grid.interpolation_points(efield)
+
+        # interpolate data to desired resolution
+        for dim in range(XYZ):
+            for unit in range(COMPLEX):
+                self.cfa[:, idx, dim, unit] = _interpolate(
+                    efield.values(dim, unit),
+                    points_old,
+                    points_new
+                )
+
+
+class _SourceGrid:
+    """
+    Reads an exported e-field in chunks of settings.CFA.chunk_size rows,
+    only parsing the x/z coordinates and the six field columns. The regular
+    grid is inferred from the first rows: one coordinate varies fastest and
+    repeats with a fixed period, the other coordinate is constant within a
+    period. The field values are written directly into a pre-allocated array,
+    such that the memory usage scales with the size of the grid instead of
+    with the size of the text file.
+    """
+
+    def __init__(self, path_efield: Path):
+        self.path = path_efield
+        self.x = None
+        self.z = None
+        self.n = 0
+        self._values = None
+        self._label_fast = None
+        self._order = None  # orders of the slow and fast points
+
+        labels = [label for labels_dim in LABELS for label in labels_dim]
+        reader = pd.read_csv(
+            path_efield,
+            delimiter=';',
+            usecols=[LABEL_X, LABEL_Z] + labels,
+            dtype=np.float64,
+            chunksize=settings.CFA.chunk_size
+        )
+
+        fast, slow, period = None, [], None
+        for chunk in reader:
+
+            # infer grid from the first rows
+            if self._values is None:
+                label_fast, label_slow, period = \
+                    _infer_grid(path_efield, chunk)
+                fast = chunk[label_fast].values[:period]
+                capacity = period * int(np.ceil(
+                    1.05 * _estimate_rows(path_efield) / period))
+                self._values = np.zeros((len(labels), capacity))
+
+            # verify that the chunk lies on the inferred grid
+            ids = np.arange(self.n, self.n + len(chunk))
+            if not np.array_equal(chunk[label_fast].values,
+                                  fast[ids % period]):
+                raise Exception('ERROR (%s): e-field is not exported on a '
+                                'regular grid' % path_efield)
+            slow.append(chunk[label_slow].values[ids % period == 0])
+
+            # grow the pre-allocated space if the estimate was too low
+            n = self.n + len(chunk)
+            if n > self._values.shape[1]:
+                values = np.zeros((len(labels),
+                                   max(n, 2 * self._values.shape[1])))
+                values[:, :self.n] = self._values[:, :self.n]
+                self._values = values
+
+            self._values[:, self.n:n] = chunk[labels].values.T
+            self.n = n
+
+        if self.n % period != 0:
+            raise Exception('ERROR (%s): e-field is not exported on a '
+                            'regular grid' % path_efield)
+
+        # unique points of both axes (as np.unique would return them)
+        slow = np.concatenate(slow)
+        self._label_fast = label_fast
+        self._order = (np.argsort(slow), np.argsort(fast))
+        if label_fast == LABEL_X:
+            self.x, self.z = np.sort(fast), np.sort(slow)
+        else:
+            self.x, self.z = np.sort(slow), np.sort(fast)
+
+    def values(self, dim: int, unit: int) -> np.ndarray:
+        """
+        field values of the column LABELS[dim][unit] on the grid [x, z]
+        """
+        # rows of the file are periods of the fast coordinate
+        order_slow, order_fast = self._order
+        values = self._values[COMPLEX * dim + unit, :self.n].reshape(
+            (len(order_slow), len(order_fast)))
+        values = values[order_slow][:, order_fast]
+        if self._label_fast == LABEL_X:
+            return values.T
+        return values
+
+
+class _SharedGrid:
+    """
+    Interpolation points of the e-field that is read first, which are used
+    for the e-fields of all antennas
+    """
+
+    def __init__(self):
+        self.path = None
+        self.points = None
+        self._lock = Lock()
+
+    def interpolation_points(self, efield: _SourceGrid):
+        with self._lock:
+            if self.points is None:
+                self.path = efield.path
+                self.points = _interpolation_points(efield)
+
+        # verify that the e-field is exported on the same grid
+        points_old = self.points[0]
+        if not np.array_equal(efield.x, points_old[0]) or \
+                not np.array_equal(efield.z, points_old[1]):
+            raise Exception('ERROR (%s): e-field is not exported on the same '
+                            'grid as %s' % (efield.path, self.path))
+        return self.points
+
+
+def source_grid_shape(path_efield: Path):
+    """
+    Shape (nx, nz) of the source grid of an exported e-field, estimated
+    from the first rows and the size of the file, such that only the start
+    of the file is read
+    """
+    reader = pd.read_csv(
+        path_efield,
+        delimiter=';',
+        usecols=[LABEL_X, LABEL_Z],
+        dtype=np.float64,
+        chunksize=settings.CFA.chunk_size
+    )
+    label_fast, _, period = _infer_grid(path_efield, next(iter(reader)))
+    reader.close()
+
+    # the number of periods follows from the estimated number of rows
+    n_periods = max(1, int(round(_estimate_rows(path_efield) / period)))
+    if label_fast == LABEL_X:
+        return period, n_periods
+    return n_periods, period
+
+
+def _infer_grid(path_efield: Path, chunk: pd.DataFrame):
+    # the fastest varying coordinate changes between the first two rows
+    if len(chunk) > 1 and chunk[LABEL_X].values[1] != \
+            chunk[LABEL_X].values[0]:
+        label_fast, label_slow = LABEL_X, LABEL_Z
+    else:
+        label_fast, label_slow = LABEL_Z, LABEL_X
+
+    # period is the first row at which the slow coordinate changes
+    slow = chunk[label_slow].values
+    changes = np.flatnonzero(slow != slow[0])
+    if len(changes) != 0:
+        period = changes[0]
+    elif len(chunk) < settings.CFA.chunk_size:
+        period = len(chunk)  # the whole file is a single period
+    else:
+        raise Exception('ERROR (%s): settings.CFA.chunk_size does not '
+                        'exceed one row of the grid' % path_efield)
+    return label_fast, label_slow, int(period)
+
+
+def _estimate_rows(path_efield: Path) -> int:
+    # estimate the number of rows from the line length at the start of file
+    size = path_efield.stat().st_size
+    with open(path_efield, 'rb') as file:
+        head = file.read(2 ** 16)
+    return max(1, int(size * head.count(b'\n') / max(1, len(head))))
+
 
-def _interpolation_points(data: pd.DataFrame):
-    points_old = (np.unique(data['#x [mm]'].values),
-                  np.unique(data['z [mm]'].values))
+def _interpolation_points(efield: _SourceGrid):
+    points_old = (efield.x, efield.z)
     points_new = _generate_xz(
         settings.Img.width,
         settings.Img.height,
-        (data['#x [mm]'].min(), data['#x [mm]'].max()),
-        (data['z [mm]'].min(), data['z [mm]'].max())
+        (efield.x.min(), efield.x.max()),
+        (efield.z.min(), efield.z.max())
     )
-    size_old = (len(np.unique(points_old[0])),
-                len(np.unique(points_old[1])))
+    size_old = (len(points_old[0]), len(points_old[1]))
     return points_old, points_new, size_old
 
 
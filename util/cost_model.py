@@ -0,0 +1,153 @@
+import heapq
+from pathlib import Path
+from typing import List
+
+import numpy as np
+import scipy.optimize
+
+import settings
+from .project_catalog import ProjectCatalog, PROCESSED
+from .stages import StageRecord
+
+# stages of which the recorded durations are summed to the project runtime
+_STAGES = ['maps', 'bounds', 'msf', 'msf_img', 'sar']
+
+
+class CostModel:
+    """
+    Estimates the runtime and peak memory of post-processing a project from
+    the metadata in the project catalog, such that the number of jobs and
+    their time/memory requests can be chosen up front (see plan.py).
+
+    The runtime is linear in the features of a project (see _features):
+        seconds = c0 + c1 * samples + c2 * csv_bytes + c3 * cells + c4 * dxf
+    The coefficients are fitted (non-negative least squares) on the
+    durations recorded in stages.json of the processed projects (the
+    stages and loading their inputs in advance), until enough projects are
+    processed the defaults of settings.Plan are used.
+
+    The memory is the size of the arrays of a project (see _project_bytes)
+    times the number of projects held at once (prefetching), on top of a
+    base of the main process and of each sample worker. Both are
+    calibrated on the recorded peak memory of the processed projects, the
+    part of the workers is scaled to settings.Parallel.n_workers, which may
+    differ from the number of workers of the calibration runs.
+    """
+
+    def __init__(self):
+        self.coefficients = np.array([
+            settings.Plan.seconds_base,
+            settings.Plan.seconds_per_sample,
+            settings.Plan.seconds_per_csv_byte,
+            settings.Plan.seconds_per_cell,
+            settings.Plan.seconds_per_entity
+        ])
+        self.memory_base = settings.Plan.memory_base
+        self.memory_worker = settings.Plan.memory_worker
+        self.n_calibration = 0
+
+    def fit(self, catalog: ProjectCatalog) -> None:
+        """
+        calibrates the model on (at most settings.Plan.n_calibration) the
+        processed projects in the catalog
+        """
+        projects = [project for name, project in sorted(
+            catalog.projects.items()) if project['status'] == PROCESSED]
+
+        features, seconds, memory_base, memory_worker = [], [], [], []
+        for project in projects[:settings.Plan.n_calibration]:
+            record = StageRecord(Path(project['path']))
+            seconds_stages = [record.seconds(name) for name in _STAGES]
+            seconds_stages.append(record.load)
+            if any(value is None for value in seconds_stages):
+                continue  # not all stages ran in this pipeline
+            features.append(_features(project))
+            seconds.append(sum(seconds_stages))
+
+            # the recorded peak is that of the whole job up to the stage,
+            # which gives an upper bound of the base
+            memory = [record.memory(name) for name in _STAGES]
+            memory = [value for value in memory if value is not None]
+            if len(memory) != 0:
+                memory_base.append(max(memory) - _project_bytes(project))
+
+            # peak of a single worker, only recorded if there were workers
+            memory = [record.memory_workers(name)[0] for name in _STAGES]
+            memory = [value for value in memory if value is not None]
+            if len(memory) != 0:
+                memory_worker.append(max(memory))
+
+        # only fit once there are more projects than coefficients
+        self.n_calibration = len(seconds)
+        if self.n_calibration > 2 * len(self.coefficients):
+            self.coefficients, _ = scipy.optimize.nnls(
+                np.array(features), np.array(seconds))
+        if len(memory_base) != 0:
+            self.memory_base = max(0, max(memory_base))
+        if len(memory_worker) != 0:
+            self.memory_worker = max(memory_worker)
+
+    def runtime(self, project: dict) -> float:
+        """
+        estimated seconds to post-process the project
+        """
+        return float(np.dot(self.coefficients, _features(project)))
+
+    def memory(self, projects: List[dict]) -> int:
+        """
+        estimated peak memory (bytes) of a job that processes the projects
+        """
+        # without workers the samples are processed by the main process
+        base = self.memory_base
+        if settings.Parallel.n_workers > 1:
+            base += settings.Parallel.n_workers * self.memory_worker
+        if len(projects) == 0:
+            return int(base)
+        n_held = min(len(projects), settings.Prefetch.depth + 1)
+        sizes = sorted((_project_bytes(project) for project in projects),
+                       reverse=True)
+        return int(base + sum(sizes[:n_held]))
+
+
+def balance(seconds: List[float], n_jobs: int) -> List[List[int]]:
+    """
+    Assigns the items with the given seconds to n_jobs jobs, such that the
+    longest job is as short as possible (longest processing time first).
+    Returns the indices of the items of each job.
+    """
+    jobs = [[] for _ in range(n_jobs)]
+    loads = [(0., job_id) for job_id in range(n_jobs)]
+    for idx in sorted(range(len(seconds)), key=lambda i: -seconds[i]):
+        load, job_id = heapq.heappop(loads)
+        jobs[job_id].append(idx)
+        heapq.heappush(loads, (load + seconds[idx], job_id))
+    return jobs
+
+
+def _features(project: dict) -> np.ndarray:
+    n_antennas = project['n_antennas']
+    cells = 0 if project['grid'] is None else int(np.prod(project['grid']))
+    return np.array([
+        1.,
+        n_antennas * settings.MSF.n,
+        sum(project['csv_bytes']),
+        n_antennas * cells,
+        project['dxf_entities']
+    ], float)
+
+
+def _project_bytes(project: dict) -> int:
+    # sizes of the largest arrays of a project
+    n_antennas = project['n_antennas']
+    n_points = settings.Img.width * settings.Img.height
+    cells = 0 if project['grid'] is None else int(np.prod(project['grid']))
+    # e-fields of which the source grids are in memory at once, the held
+    # projects (see memory) are counted as if all of them are being read
+    n_read = min(n_antennas, settings.CFA.n_threads)
+    return int(
+        8 * 6 * cells * n_read  # source grids being read (xyz, real/imag)
+        + 8 * 6 * n_points * n_antennas  # cfa
+        + 16 * 2 * n_points * n_antennas ** 2  # gram matrices (bounds)
+        + 8 * 2 * settings.MSF.n * n_antennas  # phases/amplitudes
+        + 4 * 2 * settings.MSF.n * n_points  # msf samples (+ shared copy)
+    )
@@ -0,0 +1,256 @@
+import json
+from pathlib import Path
+from typing import Iterator, List
+
+import cv2
+import numpy as np
+
+import settings
+
+MAPS = ['permittivity', 'conductivity', 'density']
+
+# prefix of the shards and index of each job of pack.py
+JOB_PREFIX = 'job_%04i'
+
+
+def record_dtype(max_antennas: int) -> np.dtype:
+    """
+    Every sample is stored as one fixed-size record, such that the position
+    of a sample within a shard is simply idx * record_size.
+    """
+    img_shape = (settings.Img.height, settings.Img.width)
+    return np.dtype([
+        ('idx', np.uint32),
+        ('n_antennas', np.uint16),
+        ('maps', np.uint8, (len(MAPS),) + img_shape),
+        ('phases', np.float32, (max_antennas,)),
+        ('amplitudes', np.float32, (max_antennas,)),
+        ('msf', np.uint8, img_shape),
+        ('sar', np.uint8, img_shape),
+    ])
+
+
+class ShardWriter:
+    """
+    Packs the msf/sar/maps of multiple projects into fixed-size binary
+    shards. Each writer (job) has its own prefix and index file, so multiple
+    writers can run in parallel and their indices can be merged afterwards
+    by 'merge_indices' without rewriting any shard. The shards and index of
+    a previous run with the same prefix are removed.
+    """
+
+    def __init__(self, folder: Path, prefix: str):
+        self.folder = Path(folder)
+        self.prefix = prefix
+        self.path_index = self.folder.joinpath('index_%s.json' % prefix)
+        self.samples_per_shard = settings.Shards.samples_per_shard
+        self.max_antennas = settings.Shards.max_antennas
+        self.dtype = record_dtype(self.max_antennas)
+        self.shards = []
+        self._file = None
+        self._shard = None
+
+        # create shards folder if it doesn't exist yet
+        if not self.folder.exists():
+            self.folder.mkdir(parents=True)
+
+        # remove the shards and index of a previous run of this writer
+        for path in self.folder.glob('%s_*.bin' % prefix):
+            path.unlink()
+        if self.path_index.exists():
+            self.path_index.unlink()
+
+    def add_project(self, path_project: Path) -> int:
+        """
+        Appends all samples of a project to the shards, returns the number
+        of added samples
+        """
+        records = _project_records(path_project, self.dtype)
+        name = path_project.name
+
+        n_written = 0
+        while n_written < len(records):
+            if self._shard is None or \
+                    self._shard['n'] == self.samples_per_shard:
+                self._next_shard()
+
+            # write as many records as fit in the current shard
+            n = min(self.samples_per_shard - self._shard['n'],
+                    len(records) - n_written)
+            self._file.write(records[n_written:n_written + n].tobytes())
+            self._shard['projects'].append([name, self._shard['n'], n])
+            self._shard['n'] += n
+            n_written += n
+
+        return n_written
+
+    def close(self) -> None:
+        """
+        Closes the current shard and saves the index of this writer
+        """
+        if self._file is not None:
+            self._file.close()
+            self._file = None
+
+        with open(self.path_index, 'w') as file:
+            json.dump(_index(self.max_antennas, self.shards), file)
+
+    def _next_shard(self) -> None:
+        if self._file is not None:
+            self._file.close()
+
+        filename = '%s_%05i.bin' % (self.prefix, len(self.shards))
+        self._shard = {'filename': filename, 'n': 0, 'projects': []}
+        self.shards.append(self._shard)
+        self._file = open(self.folder.joinpath(filename), 'wb')
+
+
+class DatasetShards:
+    """
+    Random-access reader of the (merged) shard index. The shards are memory
+    mapped, so reading a sample only touches the bytes of that record.
+    """
+
+    def __init__(self, path_index: Path):
+        self.folder = Path(path_index).parent
+        with open(path_index, 'r') as file:
+            index = json.load(file)
+        self.shards = index['shards']
+        self.dtype = record_dtype(index['max_antennas'])
+
+        # offsets[i] is the global index of the first sample in shard i
+        counts = np.array([shard['n'] for shard in self.shards], np.int64)
+        self.offsets = np.concatenate([[0], np.cumsum(counts)])
+        self._memmaps = [None] * len(self.shards)
+
+    def __len__(self) -> int:
+        return int(self.offsets[-1])
+
+    def __getitem__(self, idx: int) -> np.void:
+        if idx < 0:
+            idx += len(self)
+        if not 0 <= idx < len(self):
+            raise IndexError('sample index %i out of range' % idx)
+        idx_shard = int(np.searchsorted(self.offsets, idx, 'right')) - 1
+        return self.shard(idx_shard)[idx - self.offsets[idx_shard]]
+
+    def shard(self, idx_shard: int) -> np.memmap:
+        if self._memmaps[idx_shard] is None:
+            shard = self.shards[idx_shard]
+            self._memmaps[idx_shard] = np.memmap(
+                self.folder.joinpath(shard['filename']),
+                dtype=self.dtype,
+                mode='r',
+                shape=(shard['n'],)
+            )
+        return self._memmaps[idx_shard]
+
+    def shuffled(self, seed: int = None) -> Iterator[np.void]:
+        """
+        Iterates over all samples in random order. The shards are visited in
+        random order and each shard is read sequentially in one go before its
+        samples are shuffled, such that the storage only sees large reads.
+        """
+        rng = np.random.default_rng(seed)
+        for idx_shard in rng.permutation(len(self.shards)):
+            records = np.array(self.shard(idx_shard))
+            for idx in rng.permutation(len(records)):
+                yield records[idx]
+
+
+def merge_indices(folder: Path, n_jobs: int) -> Path:
+    """
+    Combines the indices of the n_jobs jobs of pack.py in the folder into
+    'index.json'. Raises if the index of a job is missing, or if there are
+    indices of other writers (e.g. of a previous run with more jobs), whose
+    samples would otherwise be included.
+    """
+    folder = Path(folder)
+    paths = [folder.joinpath('index_%s.json' % (JOB_PREFIX % job_id))
+             for job_id in range(n_jobs)]
+    missing = [path.name for path in paths if not path.exists()]
+    if len(missing) != 0:
+        raise Exception('ERROR: shard indices %s are missing in %s, run '
+                        'pack.py for all %i jobs first' %
+                        (', '.join(missing), folder, n_jobs))
+    extra = sorted(set(path.name for path in folder.glob('index_*.json')) -
+                   set(path.name for path in paths))
+    if len(extra) != 0:
+        raise Exception('ERROR: %s contains shard indices %s of other jobs '
+                        'than the %i given, remove them (and their shards) '
+                        'or give the number of jobs that packed the folder'
+                        % (folder, ', '.join(extra), n_jobs))
+
+    shards, max_antennas = [], None
+    for path in paths:
+        with open(path, 'r') as file:
+            index = json.load(file)
+        if max_antennas is None:
+            max_antennas = index['max_antennas']
+        elif max_antennas != index['max_antennas']:
+            raise Exception('ERROR: %s has max_antennas=%i, expected %i' %
+                            (path, index['max_antennas'], max_antennas))
+        shards += [shard for shard in index['shards'] if shard['n'] > 0]
+
+    path_index = folder.joinpath('index.json')
+    with open(path_index, 'w') as file:
+        json.dump(_index(max_antennas, shards), file)
+
+    return path_index
+
+
+def _index(max_antennas: int, shards: List[dict]) -> dict:
+    return {
+        'max_antennas': max_antennas,
+        'width': settings.Img.width,
+        'height': settings.Img.height,
+        'shards': shards
+    }
+
+
+def _project_records(path_project: Path, dtype: np.dtype) -> np.ndarray:
+    folder_msf = path_project.joinpath('msf')
+    folder_sar = path_project.joinpath('sar')
+    folder_maps = path_project.joinpath('maps')
+
+    # projects without (finished) results have no configuration
+    path_configuration = folder_msf.joinpath('configuration.json')
+    if not path_configuration.exists():
+        return np.zeros(0, dtype)
+    with open(path_configuration, 'r') as file:
+        configurations = json.load(file)
+
+    # the input maps are the same for each sample of the project
+    maps = np.stack([
+        _read_img(folder_maps.joinpath('%s.png' % name)) for name in MAPS
+    ])
+
+    max_antennas = dtype['phases'].shape[0]
+    records = np.zeros(len(configurations), dtype)
+    for idx, conf in enumerate(configurations):
+        na = len(conf['phases'])
+        if na > max_antennas:
+            raise Exception('ERROR (%s): %i antennas exceed '
+                            'settings.Shards.max_antennas=%i' %
+                            (path_project, na, max_antennas))
+
+        # filenames are absolute paths of the machine that generated them
+        filename = Path(conf['filename']).name
+
+        records['idx'][idx] = idx
+        records['n_antennas'][idx] = na
+        records['maps'][idx] = maps
+        records['phases'][idx, :na] = conf['phases']
+        records['amplitudes'][idx, :na] = conf['amplitudes']
+        records['msf'][idx] = _read_img(folder_msf.joinpath(filename))
+        records['sar'][idx] = _read_img(
+            folder_sar.joinpath(filename.replace('msf', 'sar')))
+
+    return records
+
+
+def _read_img(path: Path) -> np.ndarray:
+    img = cv2.imread(str(path), cv2.IMREAD_GRAYSCALE)
+    if img is None:
+        raise Exception('ERROR: unable to read %s' % path)
+    return img
@@ -5,6 +5,7 @@ import dxfgrabber
 import numpy as np
 
 import settings
+from .dxf_entities import DxfEntity, from_dxfgrabber, read_entities
 
 path = None  # todo: remove
 
@@ -14,7 +15,15 @@ class DrawingInterchangeFormat:
     def __init__(self, path_project: Path, materials: dict):
         global path  # todo: remove
         path = path_project  # todo: remove
-        self.dxf = dxfgrabber.readfile(path_project.joinpath('model2d.dxf'))
+
+        # only the entities are read, the full document is only parsed if
+        # the dxf contains entities that the reader doesn't support
+        self.path_dxf = path_project.joinpath('model2d.dxf')
+        self.dxf = None
+        self.entities = read_entities(self.path_dxf)
+        if self.entities is None:
+            self.dxf = dxfgrabber.readfile(self.path_dxf)
+            self.entities = from_dxfgrabber(self.dxf)
         self.folder = path_project.joinpath('maps')
         self.filenames = {
             'mod': str(self.folder.joinpath('model.png')),
@@ -22,6 +31,7 @@ class DrawingInterchangeFormat:
             'con': str(self.folder.joinpath('conductivity.png')),
             'den': str(self.folder.joinpath('density.png'))
         }
+        self.paths_map = _paths_map(path_project)
         self.width = settings.Img.width
         self.height = settings.Img.height
         self.materials = materials
@@ -33,6 +43,8 @@ class DrawingInterchangeFormat:
             self.material_obj_names.append(material['object_name'].upper())
 
     def print(self) -> None:
+        if self.dxf is None:
+            self.dxf = dxfgrabber.readfile(self.path_dxf)
         dxf = self.dxf
         entity_layers = []
         for ent in dxf.entities:
@@ -76,14 +88,18 @@ class DrawingInterchangeFormat:
         for key in maps:
             cv2.imwrite(self.filenames[key], maps[key])
 
+        # save the unquantized density & conductivity maps, which are needed
+        # to (re)calculate the sar
+        np.save(self.paths_map['den'], self.map_den)
+        np.save(self.paths_map['con'], self.map_con)
+
     def _generate_maps(self):
 
         # extract lines from entities
         objects = {}
-        for ent in self.dxf.entities:
-            if ent.layer not in objects:
-                objects[ent.layer] = _Object()
-            objects[ent.layer].lines.append(_Line(ent))
+        for layer, entities in self.entities.items():
+            objects[layer] = _Object()
+            objects[layer].lines = [_Line(ent) for ent in entities]
 
         # combine lines into shapes,
         #   one object consists out of 1 or multiple shapes
@@ -145,8 +161,45 @@ class DrawingInterchangeFormat:
         return {'mod': img_mod, 'per': img_per, 'con': img_con, 'den': img_den}
 
 
+def count_entities(path_dxf: Path) -> int:
+    """
+    number of POLYLINE and CIRCLE entities, without parsing the dxf
+    """
+    # binary, the encoding of the dxf is given in its header
+    n = 0
+    with open(path_dxf, 'rb') as file:
+        for line in file:
+            if line.strip() in (b'POLYLINE', b'CIRCLE'):
+                n += 1
+    return n
+
+
+def load_maps(path_project: Path):
+    """
+    loads the density & conductivity maps saved by DrawingInterchangeFormat
+    """
+    paths_map = _paths_map(path_project)
+    return np.load(paths_map['den']), np.load(paths_map['con'])
+
+
+def domain_mask(map_density: np.ndarray) -> np.ndarray:
+    """
+    pixels inside the simulated domain, i.e. the pixels with a non-zero
+    density, flattened in the same order as the points of the cfa
+    """
+    return map_density.reshape(-1) > 0
+
+
+def _paths_map(path_project: Path) -> dict:
+    folder = path_project.joinpath('maps')
+    return {
+        'den': folder.joinpath('density.npy'),
+        'con': folder.joinpath('conductivity.npy')
+    }
+
+
 class _Line:
-    def __init__(self, ent):
+    def __init__(self, ent: DxfEntity):
         if ent.dxftype == 'POLYLINE':
             if ent.mode == 'spline2d':
 
@@ -209,18 +262,19 @@ class _Line:
         return points
 
     @staticmethod
-    def arc_to_line(ent):
+    def arc_to_line(ent: DxfEntity):
         points = np.array([]).reshape((-1, 2))
-        for v1, v2 in zip(ent.vertices[:-1], ent.vertices[1:]):
-            d = _distance_3d(v1.location, v2.location)
-            angle = 4 * np.arctan(v1.bulge)
+        for v1, v2, bulge in zip(ent.vertices[:-1], ent.vertices[1:],
+                                 ent.bulges[:-1]):
+            d = _distance_3d(v1, v2)
+            angle = 4 * np.arctan(bulge)
 
             # arc
-            if v1.bulge != 0:
+            if bulge != 0:
                 r = np.abs(d / (2 * np.sin(0.5 * angle)))
 
                 # convert each location to angle relative to origin (0, 0)
-                theta_start = np.arctan2(v1.location[0], v1.location[1])
+                theta_start = np.arctan2(v1[0], v1[1])
                 theta_end = theta_start - angle
 
                 # generate points
@@ -233,10 +287,8 @@ class _Line:
                 points = np.append(points, xy, 0)
 
             # bulge == 0 is basically a straight line
-            if v1.bulge == 0:
-                xyz = np.linspace(v1.location,
-                                  v2.location,
-                                  settings.DXF.n_arc)
+            if bulge == 0:
+                xyz = np.linspace(v1, v2, settings.DXF.n_arc)
                 points = np.append(points, xyz[:, :2], 0)
 
         # return points
@@ -0,0 +1,164 @@
+import re
+from pathlib import Path
+from typing import Dict, List, Optional
+
+import numpy as np
+
+# polyline flags (group code 70) that determine the mode, as in dxfgrabber
+_MODES = [(4, 'spline2d'), (8, 'polyline3d'), (16, 'polymesh'),
+          (64, 'polyface')]
+
+# vertex flag of the control points of a spline frame, which are no points
+# of the polyline itself
+_SPLINE_FRAME_CONTROL_POINT = 16
+
+# start of the ENTITIES section, i.e. the tags (0, SECTION) (2, ENTITIES)
+_SECTION = re.compile(rb'(^|\n)[ \t]*2[ \t]*\r?\n[ \t]*ENTITIES[ \t]*\r?\n')
+
+
+class DxfEntity:
+    """
+    A POLYLINE or CIRCLE entity of a dxf file:
+        vertices:   locations of all vertices [n, 3]
+        bulges:     bulge of each vertex [n]
+        points:     locations of the vertices that are no spline frame
+                    control points [m, 3]
+        center:     center of a circle [3]
+        radius:     radius of a circle
+    """
+
+    def __init__(self, dxftype: str, layer: str):
+        self.dxftype = dxftype
+        self.layer = layer
+        self.mode = 'polyline2d'
+        self.vertices = np.zeros((0, 3))
+        self.bulges = np.zeros(0)
+        self.points = np.zeros((0, 3))
+        self.center = np.zeros(3)
+        self.radius = 1.
+
+
+def read_entities(path_dxf: Path) -> Optional[Dict[str, List[DxfEntity]]]:
+    """
+    Reads the POLYLINE and CIRCLE entities of a dxf file, grouped by layer
+    (in order of their first occurrence). Only the ENTITIES section is
+    parsed, the rest of the file (header, tables, blocks, ...) is skipped.
+
+    Returns None if the ENTITIES section contains other entities, or if it
+    can't be found, in which case the full parser (dxfgrabber, see
+    from_dxfgrabber) is needed.
+    """
+    with open(path_dxf, 'rb') as file:
+        data = file.read()
+
+    # locate the ENTITIES section
+    match = _SECTION.search(data)
+    if match is None:
+        return None
+    end = data.find(b'ENDSEC', match.end())
+    if end == -1:
+        return None
+    lines = data[match.end():end + len(b'ENDSEC')].split(b'\n')
+
+    try:
+        parsed = _parse(lines)
+    except (ValueError, UnicodeDecodeError):
+        return None  # e.g. a layer name in the encoding of the header
+    if parsed is None:
+        return None
+
+    entities = {}
+    for entity in parsed:
+        entities.setdefault(entity.layer, []).append(entity)
+    return entities
+
+
+def from_dxfgrabber(dxf) -> Dict[str, List[DxfEntity]]:
+    """
+    Entities of a dxf document read by dxfgrabber, grouped by layer (in
+    order of their first occurrence). Entities other than POLYLINE and
+    CIRCLE are included without any data, such that the caller can report
+    them.
+    """
+    entities = {}
+    for ent in dxf.entities:
+        entity = DxfEntity(ent.dxftype, ent.layer)
+        if ent.dxftype == 'POLYLINE':
+            entity.mode = ent.mode
+            _set_vertices(entity, [
+                _xyz(vertex.location) + [vertex.bulge, vertex.flags]
+                for vertex in ent.vertices
+            ])
+        elif ent.dxftype == 'CIRCLE':
+            entity.center = np.array(_xyz(ent.center))
+            entity.radius = ent.radius
+        entities.setdefault(entity.layer, []).append(entity)
+    return entities
+
+
+def _parse(lines: List[bytes]) -> Optional[List[DxfEntity]]:
+    # tags are pairs of lines, a group code and its value
+    parsed = []
+    entity, vertices, record = None, [], None
+    for code, value in zip(lines[0::2], lines[1::2]):
+        code = int(code)
+
+        # start of a new entity or vertex
+        if code == 0:
+            record = value.strip()
+            if record == b'ENDSEC':
+                break
+            elif record == b'VERTEX' and entity is not None:
+                # location (x, y, z), bulge & flags
+                vertices.append([0., 0., 0., 0., 0])
+            elif record == b'SEQEND' and entity is not None:
+                _set_vertices(entity, vertices)
+                entity, vertices = None, []
+            elif record in (b'POLYLINE', b'CIRCLE'):
+                # the layer is '0' unless given
+                entity = DxfEntity(record.decode(), '0')
+                parsed.append(entity)
+                vertices = []
+            else:
+                return None
+
+        # attributes of the vertex
+        elif record == b'VERTEX':
+            if 10 <= code <= 30 and code % 10 == 0:
+                vertices[-1][code // 10 - 1] = float(value)
+            elif code == 42:
+                vertices[-1][3] = float(value)
+            elif code == 70:
+                vertices[-1][4] = int(value)
+
+        # attributes of the polyline/circle
+        elif record in (b'POLYLINE', b'CIRCLE'):
+            if code == 8:
+                entity.layer = value.strip().decode('ascii')
+            elif code == 70 and record == b'POLYLINE':
+                flags = int(value)
+                for flag, mode in _MODES:
+                    if flags & flag:
+                        entity.mode = mode
+                        break
+            elif 10 <= code <= 30 and code % 10 == 0 and \
+                    record == b'CIRCLE':
+                entity.center[code // 10 - 1] = float(value)
+            elif code == 40 and record == b'CIRCLE':
+                entity.radius = float(value)
+
+    return parsed
+
+
+def _xyz(location) -> list:
+    # locations of 2d entities may lack the z-coordinate
+    return (list(location) + [0., 0.])[:3]
+
+
+def _set_vertices(entity: DxfEntity, vertices: list) -> None:
+    vertices = np.array(vertices, float).reshape((-1, 5))
+    flags = vertices[:, 4].astype(int)
+    entity.vertices = vertices[:, :3]
+    entity.bulges = vertices[:, 3]
+    entity.points = entity.vertices[
+        (flags & _SPLINE_FRAME_CONTROL_POINT) == 0]
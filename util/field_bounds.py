@@ -0,0 +1,92 @@
+from pathlib import Path
+
+import numpy as np
+
+import settings
+from .complex_field_per_antenna import REAL, IMAG, ComplexFieldPerAntenna
+from .drawing_interchange_format import domain_mask
+from .print import Print
+
+
+class FieldBounds:
+    """
+    Upper bounds of the msf and sar of each pixel, over all phases and
+    amplitudes that the MeanSquareField can sample.
+
+    With complex antenna weights w (|w| <= amplitude_limit[1]) and complex
+    field e[antenna, xyz] of a pixel, the msf of that pixel is the Hermitian
+    quadratic form
+        msf = 0.5 * w^H G w,    G[a, b] = sum_xyz conj(e[a, xyz]) e[b, xyz]
+    which is bounded by both
+        0.5 * |w|^2 * max(eig(G))   and   0.5 * max(|w|)^2 * sum(|G|).
+    The lower bound is 0, since all amplitudes can be (close to) 0.
+
+    Like the msf/sar trackers, the logged ranges only consider the pixels
+    inside the simulated domain.
+    """
+
+    def __init__(
+            self,
+            cfa_obj: ComplexFieldPerAntenna,
+            map_density: np.ndarray,
+            map_conductivity: np.ndarray
+    ):
+        # per-pixel antenna Gram matrix, shape [n_points, n_antenna, n_antenna]
+        cfa = cfa_obj.cfa[:, :, :, REAL] + 1j * cfa_obj.cfa[:, :, :, IMAG]
+        gram = np.einsum('pai,pbi->pab', cfa.conj(), cfa)
+
+        # bounds of the quadratic form
+        amplitude_max = settings.MSF.amplitude_limit[1]
+        bound_eig = cfa_obj.na * np.linalg.eigvalsh(gram)[:, -1]
+        bound_sum = np.sum(np.abs(gram), axis=(1, 2))
+        img_shape = (settings.Img.width, settings.Img.height)
+        self.msf_max = 0.5 * amplitude_max ** 2 * \
+            np.minimum(bound_eig, bound_sum).reshape(img_shape)
+
+        # pixels inside the simulated domain
+        self.mask = domain_mask(map_density).reshape(img_shape)
+
+        # sar is the msf scaled by the conductivity/density of each pixel
+        delta = 1e-20
+        self.sar_max = self.msf_max * map_conductivity / (map_density + delta)
+
+    def save(self, path: Path) -> None:
+        np.savez(path, msf_max=self.msf_max, sar_max=self.sar_max)
+
+    def log(self, print_: Print.log) -> None:
+        """
+        logs the dB ranges that can occur and warns if they exceed the ranges
+        given in the settings file
+        """
+        delta = 1e-20
+
+        # msf (inside the domain), pixels whose upper bound is below db_min
+        # are always clipped
+        db_msf = 10 * np.log10(self.msf_max[self.mask] + delta)
+        if len(db_msf) == 0:
+            print_('\tMSF upper bound = 0, no pixels inside the domain')
+            return
+        print_('\tMSF upper bound = %f dB, lowest pixel upper bound = %f dB'
+               % (np.max(db_msf), np.min(db_msf)))
+        if np.max(db_msf) > settings.MSF.db_max:
+            print_('WARNING: MSF upper bound exceeds given maximum\n'
+                   '\tdb_msf_bound=%f\n\tsettings db_max=%f' %
+                   (np.max(db_msf), settings.MSF.db_max))
+        n_clipped = np.sum(db_msf < settings.MSF.db_min)
+        if n_clipped != 0:
+            print_('WARNING: MSF of %i pixels is always below given minimum\n'
+                   '\tsettings db_min=%f' % (n_clipped, settings.MSF.db_min))
+
+        # sar (inside the domain), only the non-zero sar-values -> dB[delta]
+        # is considered zero.
+        db_sar = 10 * np.log10(self.sar_max[self.mask] + delta)
+        db_sar = db_sar[db_sar != 10 * np.log10(delta)]
+        if len(db_sar) == 0:
+            print_('\tSAR upper bound = 0')
+            return
+        print_('\tSAR upper bound = %f dB, lowest pixel upper bound = %f dB'
+               % (np.max(db_sar), np.min(db_sar)))
+        if np.max(db_sar) > settings.SAR.db_max:
+            print_('WARNING: SAR upper bound exceeds given maximum\n'
+                   '\tdb_sar_bound=%f\n\tsettings db_max=%f' %
+                   (np.max(db_sar), settings.SAR.db_max))
@@ -0,0 +1,200 @@
+import json
+import os
+import socket
+from pathlib import Path
+from time import time
+from typing import List
+
+import numpy as np
+
+import settings
+from .json_file import write_json
+
+
+class Heartbeat:
+    """
+    Keeps a small json file per job up to date with the progress of that
+    job (current project, samples done, samples per second, bytes written,
+    eta and memory usage), such that all running jobs can be monitored from
+    a single place with aggregate_heartbeats.
+
+    A sample is a single iteration of the sample loop of a stage (msf,
+    msf_img or sar). The samples per second only consider the time spent in
+    these stages, such that loading the inputs or generating the maps
+    doesn't make a job look slow. The file is written at most once every
+    settings.Heartbeat.interval seconds, and at the start of each project
+    and the start and end of each stage.
+    """
+
+    def __init__(
+            self,
+            job_id: int,
+            n_jobs: int,
+            partition_id: int,
+            n_projects: int
+    ):
+        self.path = Path(settings.Paths.root).joinpath(
+            'heartbeat_%i_%i.json' % (job_id, partition_id))
+        self.state = {
+            'job_id': job_id,
+            'n_jobs': n_jobs,
+            'partition_id': partition_id,
+            'host': socket.gethostname(),
+            'pid': os.getpid(),
+            'started': time(),
+            'updated': time(),
+            'finished': False,
+            'project': None,
+            'stage': None,
+            'sampling': False,
+            'projects_done': 0,
+            'n_projects': n_projects,
+            'samples_done': 0,
+            'samples_per_second': 0.,
+            'bytes_written': 0,
+            'eta_seconds': None,
+            'memory_bytes': None,
+        }
+
+        # samples of the current project
+        self._samples_project = 0
+        self._samples_expected = 0
+
+        # samples and seconds of sample work since the last write, used for
+        # the samples per second
+        self._samples_window = 0
+        self._seconds_window = 0.
+        self._time_mark = time()
+
+    def start_project(
+            self,
+            idx: int,
+            path_project: Path,
+            n_projects: int = None
+    ) -> None:
+        """
+        n_projects updates the number of projects of the job, if it isn't
+        known in advance (e.g. when taking projects from a queue)
+        """
+        self.state['project'] = str(path_project)
+        self.state['projects_done'] = idx
+        if n_projects is not None:
+            self.state['n_projects'] = n_projects
+        self._samples_project = 0
+        self._samples_expected = 0
+        self.write(force=True)
+
+    def start_stage(self, name: str, sampling: bool = False) -> None:
+        """
+        sampling indicates that the stage reports its samples
+        """
+        self._account(time())
+        self.state['stage'] = name
+        self.state['sampling'] = sampling
+        self.write(force=True)
+
+    def end_stage(self) -> None:
+        self._account(time())
+        self.state['stage'] = None
+        self.state['sampling'] = False
+        self.write(force=True)
+
+    def expect(self, n_samples: int) -> None:
+        """
+        sets the number of samples of the current project
+        """
+        self._samples_expected = n_samples
+
+    def add(self, n_samples: int = 0, n_bytes: int = 0) -> None:
+        self.state['samples_done'] += n_samples
+        self.state['bytes_written'] += n_bytes
+        self._samples_project += n_samples
+        self._samples_window += n_samples
+        self.write()
+
+    def finish(self) -> None:
+        self.state['projects_done'] = self.state['n_projects']
+        self.state['project'] = None
+        self.state['stage'] = None
+        self.state['sampling'] = False
+        self.state['finished'] = True
+        self._samples_expected = 0
+        self.write(force=True)
+
+    def write(self, force: bool = False) -> None:
+        now = time()
+        if not force and now - self.state['updated'] < \
+                settings.Heartbeat.interval:
+            return
+
+        # samples per second of the sample work since the previous write,
+        # the previous rate is kept if there was no sample work
+        self._account(now)
+        if self._seconds_window > 0:
+            self.state['samples_per_second'] = \
+                self._samples_window / self._seconds_window
+            self._samples_window = 0
+            self._seconds_window = 0.
+
+        self.state['updated'] = now
+        self.state['eta_seconds'] = self._eta(now)
+        self.state['memory_bytes'] = _memory_usage()
+
+        write_json(self.path, self.state)
+
+    def _account(self, now: float) -> None:
+        # adds the time since the previous call to the sample work, if the
+        # current stage is a sample stage
+        if self.state['sampling']:
+            self._seconds_window += now - self._time_mark
+        self._time_mark = now
+
+    def _eta(self, now: float):
+        # fraction of the projects that is done, including the current one
+        done = self.state['projects_done']
+        if self._samples_expected > 0:
+            done += min(1., self._samples_project / self._samples_expected)
+        if done == 0:
+            return None
+        elapsed = now - self.state['started']
+        return elapsed * (self.state['n_projects'] - done) / done
+
+
+def aggregate_heartbeats(root: Path) -> List[dict]:
+    """
+    Reads the heartbeats of all jobs in root and flags the jobs that are
+    stalled (no update in settings.Heartbeat.stalled seconds) or slow
+    (samples per second below settings.Heartbeat.slow times the median of
+    the jobs that are running a sample stage)
+    """
+    heartbeats = []
+    for path in sorted(Path(root).glob('heartbeat_*.json')):
+        try:
+            with open(path, 'r') as file:
+                heartbeats.append(json.load(file))
+        except (OSError, ValueError):
+            continue  # removed or not yet written
+
+    now = time()
+    sampling = [hb for hb in heartbeats
+                if not hb['finished'] and hb['sampling']]
+    rates = [hb['samples_per_second'] for hb in sampling]
+    median = float(np.median(rates)) if len(rates) != 0 else 0.
+    for hb in heartbeats:
+        hb['age_seconds'] = now - hb['updated']
+        hb['stalled'] = not hb['finished'] and \
+            hb['age_seconds'] > settings.Heartbeat.stalled
+        hb['slow'] = not hb['finished'] and hb['sampling'] and \
+            hb['samples_per_second'] < settings.Heartbeat.slow * median
+
+    return heartbeats
+
+
+def _memory_usage():
+    # resident set size of this process in bytes, only available on linux
+    try:
+        with open('/proc/self/statm', 'r') as file:
+            pages = int(file.read().split()[1])
+        return pages * os.sysconf('SC_PAGE_SIZE')
+    except (OSError, ValueError, AttributeError):
+        return None
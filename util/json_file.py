@@ -0,0 +1,24 @@
+import json
+import os
+import tempfile
+from pathlib import Path
+
+
+def write_json(path: Path, data) -> None:
+    """
+    Writes data to the json file atomically: the data is written to a
+    temporary file in the same folder first, which then replaces the file.
+    A reader never sees a partially written file, and the temporary file is
+    unique, such that processes can write the same file at once (the last
+    one wins).
+    """
+    path = Path(path)
+    fd, path_tmp = tempfile.mkstemp(
+        prefix=path.name + '.', suffix='.tmp', dir=path.parent)
+    try:
+        with os.fdopen(fd, 'w') as file:
+            json.dump(data, file)
+        os.replace(path_tmp, path)
+    except BaseException:
+        os.remove(path_tmp)
+        raise
@@ -1,11 +1,13 @@
 import json
 from pathlib import Path
+from typing import Optional
 
 import cv2
 import numpy as np
 
 import settings
 from util.complex_field_per_antenna import REAL, IMAG, ComplexFieldPerAntenna
+from .buffers import Buffers, zeros
 from .print import Print
 
 
@@ -23,23 +25,65 @@ class MeanSquareField:
 
     This object will stop iterating after 'settings.MSF.n' samples are
     generated.
+
+    The msf is only calculated for the pixels inside the simulated domain
+    (mask, flattened in the order of the cfa points), in a packed form of
+    shape [n_active]. It is scattered back to the image in to_img, pixels
+    outside the domain are set to db_min.
+
+    The random phases/amplitudes of all samples are drawn up front by
+    generate_configurations, such that the samples can be generated in any
+    order (or in parallel by other processes, see arrays/set_arrays) with
+    the same result.
+
+    The raw (unquantized) msf of each sample is kept in 'samples' and saved
+    to 'msf.npy' (together with the mask in 'mask.npy'), such that the
+    images can be regenerated from it without the cfa (in which case
+    cfa_obj is None, see load_samples).
+
+    If buffers are given, the arrays of the samples are placed in these
+    (reused) buffers.
     """
 
     def __init__(
             self,
             path_project: Path,
-            cfa_obj: ComplexFieldPerAntenna,
-            print_: Print.log
+            cfa_obj: Optional[ComplexFieldPerAntenna],
+            print_: Print.log,
+            mask: np.ndarray = None,
+            buffers: Buffers = None
     ):
         self.cfa_obj = cfa_obj
         self.folder = path_project.joinpath('msf')
         self.path_configuration = self.folder.joinpath('configuration.json')
+        self.path_samples = self.folder.joinpath('msf.npy')
+        self.path_mask = self.folder.joinpath('mask.npy')
         self.configurations = []
         self.print_ = print_
+        self.mask = mask
 
         # pre-allocate space
-        self.cfa = np.zeros(cfa_obj.cfa.shape)
-        self.msf = np.zeros((cfa_obj.np, 1))
+        self.cfa = None
+        self.cfa_active = None
+        self.all_phases = None
+        self.all_amplitudes = None
+        self.samples = None
+        self.msf = None
+        if cfa_obj is not None:
+            if self.mask is None:
+                self.mask = np.ones(cfa_obj.np, bool)
+            n_active = int(np.sum(self.mask))
+            self.cfa_active = zeros(buffers, 'cfa_active',
+                                    (n_active,) + cfa_obj.cfa.shape[1:])
+            np.compress(self.mask, cfa_obj.cfa, axis=0, out=self.cfa_active)
+            self.cfa = zeros(buffers, 'cfa_msf', self.cfa_active.shape)
+            self.all_phases = zeros(buffers, 'all_phases',
+                                    (settings.MSF.n, cfa_obj.na))
+            self.all_amplitudes = zeros(buffers, 'all_amplitudes',
+                                        (settings.MSF.n, cfa_obj.na))
+            self.samples = zeros(buffers, 'samples',
+                                 (settings.MSF.n, n_active), np.float32)
+            self.msf = np.zeros(len(self.cfa_active))
 
         # define attributes
         self.cos_phase = None
@@ -53,21 +97,36 @@ class MeanSquareField:
         self.max = 0
         self.min = 0
 
+    def generate_configurations(self) -> None:
+        """
+        draws the random phases & amplitudes of all samples
+        """
+        for idx in range(settings.MSF.n):
+            # generate random phases, note that phase of first antenna is 0
+            self.all_phases[idx] = np.random.uniform(
+                low=settings.MSF.phase_limit[0],
+                high=settings.MSF.phase_limit[1],
+                size=self.cfa_obj.na
+            )
+            self.all_phases[idx, 0] = 0.
+
+            # generate random amplitudes
+            self.all_amplitudes[idx] = np.random.uniform(
+                low=settings.MSF.amplitude_limit[0],
+                high=settings.MSF.amplitude_limit[1],
+                size=self.cfa_obj.na
+            )
+
+            # add msf to generated_msf list of dict
+            self.configurations.append({
+                'filename': str(self.folder.joinpath('msf_%04i.png' % idx)),
+                'phases': list(self.all_phases[idx]),
+                'amplitudes': list(self.all_amplitudes[idx])
+            })
+
     def generate_msf(self, idx: int):
-        # generate random phases, note that phase of first antenna is 0
-        self.phases = np.random.uniform(
-            low=settings.MSF.phase_limit[0],
-            high=settings.MSF.phase_limit[1],
-            size=self.cfa_obj.na
-        )
-        self.phases[0] = 0.
-
-        # generate random amplitudes
-        self.amplitudes = np.random.uniform(
-            low=settings.MSF.amplitude_limit[0],
-            high=settings.MSF.amplitude_limit[1],
-            size=self.cfa_obj.na
-        )
+        self.phases = self.all_phases[idx]
+        self.amplitudes = self.all_amplitudes[idx]
 
         # apply phase shifts to cfa
         self._shift_cfa()
@@ -77,31 +136,58 @@ class MeanSquareField:
 
         # calculate msf
         self._mean_square()
+        self.samples[idx] = self.msf
+
+        # select the (stored) sample, such that the image is always created
+        # from the same precision as when it is regenerated from msf.npy
+        return self.select(idx)
 
-        # set idx & filename
+    def select(self, idx: int):
+        """
+        sets the current msf (and its idx & filename) to the given sample
+        """
+        self.msf = self.samples[idx]
         self.idx = idx
         self.filename = str(self.folder.joinpath('msf_%04i.png' % idx))
+        return self
 
-        # add msf to generated_msf list of dict
-        self.configurations.append({
-            'filename': self.filename,
-            'phases': list(self.phases),
-            'amplitudes': list(self.amplitudes)
-        })
-
-        # return msf as image
+    def arrays(self) -> dict:
+        """
+        the arrays that are needed to generate and save samples
+        """
+        arrays = {
+            'cfa_active': self.cfa_active,
+            'all_phases': self.all_phases,
+            'all_amplitudes': self.all_amplitudes,
+            'samples': self.samples,
+            'mask': self.mask
+        }
+        return {key: value for key, value in arrays.items()
+                if value is not None}
+
+    def set_arrays(self, arrays: dict):
+        """
+        uses the given arrays (as returned by arrays) instead of its own
+        """
+        for key, value in arrays.items():
+            setattr(self, key, value)
+        if self.cfa_active is not None:
+            self.cfa = np.zeros(self.cfa_active.shape)
         return self
 
-    def save_map(self) -> None:
+    def save_map(self) -> int:
         """
-        saves a single generated msf map
+        saves a single generated msf map, returns the number of bytes written
         """
         # create msf folder if it doesn't exist yet
         if not self.folder.exists():
-            self.folder.mkdir()
+            self.folder.mkdir(exist_ok=True)
 
         # write image to msf folder
-        cv2.imwrite(self.filename, self.to_img())
+        _, buffer = cv2.imencode('.png', self.to_img())
+        with open(self.filename, 'wb') as file:
+            file.write(buffer)
+        return len(buffer)
 
     def save_configurations(self):
         """"
@@ -111,15 +197,40 @@ class MeanSquareField:
         with open(self.path_configuration, 'w') as file:
             json.dump(self.configurations, file)
 
+    def save_samples(self) -> int:
+        """
+        saves the raw msf of all generated samples, returns the number of
+        bytes written
+        """
+        # create msf folder if it doesn't exist yet
+        if not self.folder.exists():
+            self.folder.mkdir(exist_ok=True)
+
+        np.save(self.path_samples, self.samples)
+        np.save(self.path_mask, self.mask)
+        return self.path_samples.stat().st_size + \
+            self.path_mask.stat().st_size
+
+    def load_samples(self):
+        """
+        loads the raw msf samples and configurations saved by a previous run
+        """
+        self.samples = np.load(self.path_samples)
+        self.mask = np.load(self.path_mask)
+        with open(self.path_configuration, 'r') as file:
+            self.configurations = json.load(file)
+        return self
+
     def to_img(self) -> np.ndarray:
-        # reshape msf to img-width/height
-        img_shape = (settings.Img.width, settings.Img.height)
-        msf = self.msf.reshape(img_shape)
+        # use dB scale, msf only contains the active pixels
+        msf = 10 * np.log10(self.msf)
 
-        # use dB scale
-        msf = 10 * np.log10(msf)
+        # return an empty image if there are no active pixels
+        if len(msf) == 0:
+            img_shape = (settings.Img.width, settings.Img.height)
+            return np.zeros(img_shape, np.uint8)
 
-        # set min max
+        # set min max (of the active pixels)
         if np.max(msf) > self.max:
             self.max = np.max(msf)
         if np.min(msf) < self.min:
@@ -140,13 +251,13 @@ class MeanSquareField:
         msf = 255 * (msf - settings.MSF.db_min) / a
 
         # return msf as img
-        return msf.astype(np.uint8)
+        return scatter(msf.astype(np.uint8), self.mask)
 
     def _shift_cfa(self) -> None:
         # todo: find a different solution to slicing, since that will return
         #  a copy of the ndarray (i think), this  increases computation time
 
-        # cfa : ndarray, shape [n_points, n_antenna, (x,y,z), (real,imag) ]
+        # cfa : ndarray, shape [n_active, n_antenna, (x,y,z), (real,imag) ]
 
         # reshape cos_phase and sin_phase such that numpy knows which
         # dimension must be multiplied element-wise
@@ -154,8 +265,8 @@ class MeanSquareField:
         sin_phase = np.sin(self.phases).reshape(1, -1, 1)
 
         # real and imag part of cfa
-        cfa_real = self.cfa_obj.cfa[:, :, :, REAL]
-        cfa_imag = self.cfa_obj.cfa[:, :, :, IMAG]
+        cfa_real = self.cfa_active[:, :, :, REAL]
+        cfa_imag = self.cfa_active[:, :, :, IMAG]
 
         # shift cfa
         self.cfa[:, :, :, REAL] = cfa_real * cos_phase - cfa_imag * sin_phase
@@ -166,3 +277,13 @@ class MeanSquareField:
 
     def _mean_square(self) -> None:
         self.msf = 0.5 * np.sum(np.sum(self.cfa, axis=1) ** 2, axis=(1, 2))
+
+
+def scatter(packed: np.ndarray, mask: np.ndarray) -> np.ndarray:
+    """
+    Scatters the packed values of the active pixels back to an image, the
+    inactive pixels are 0
+    """
+    img = np.zeros(len(mask), packed.dtype)
+    img[mask] = packed
+    return img.reshape((settings.Img.width, settings.Img.height))
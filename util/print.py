@@ -1,6 +1,7 @@
 import os
 import subprocess
 from datetime import datetime
+from functools import lru_cache
 
 # os.name = nt: Windows OR posix: Linux
 is_running_on_desktop = os.name == 'nt'
@@ -65,9 +66,15 @@ def system_info(
     info += 'partition_id = %i\n' % partition_id
     if not is_running_on_desktop:
         info += "cpu info:\n"
-        info += subprocess.check_output('lscpu', shell=True).decode('utf-8')
+        info += _cpu_info()
         info += '\n'
         info += "memory info:\n"
         info += subprocess.check_output('free -h', shell=True).decode('utf-8')
         info += '\n'
     return info
+
+
+@lru_cache()
+def _cpu_info() -> str:
+    # doesn't change while running, so only determined once per process
+    return subprocess.check_output('lscpu', shell=True).decode('utf-8')
@@ -0,0 +1,155 @@
+import json
+import os
+from pathlib import Path
+from typing import List
+
+import settings
+from .complex_field_per_antenna import source_grid_shape
+from .drawing_interchange_format import count_entities
+from .json_file import write_json
+
+NO_RESULTS = 'no_results'
+UNPROCESSED = 'unprocessed'
+PROCESSED = 'processed'
+
+
+class ProjectCatalog:
+    """
+    Catalog of all projects in the root, stored in settings.Catalog.path,
+    such that jobs can select their projects without globbing the root and
+    probing every project folder.
+
+    Per project it holds the path, the number of antennas, the sizes of the
+    e-field csv files, the shape of the source grid, the number of dxf
+    entities and the processing status. refresh only probes the projects
+    that are new or whose folder changed (modification time) since the
+    previous refresh. Files created or deleted in the subfolders don't
+    change the modification time of the project folder, so the results
+    (sar/configuration.json) of projects with results are checked on every
+    refresh. The grid and dxf entities are only determined again if their
+    source file changed (size or modification time).
+
+    The catalog is refreshed once before the jobs are submitted (see
+    catalog.py and server.sh), the jobs only read it.
+    """
+
+    def __init__(self, path: Path = settings.Catalog.path):
+        self.path = Path(path)
+        self.projects = {}
+        if self.path.exists():
+            with open(self.path, 'r') as file:
+                self.projects = json.load(file)['projects']
+
+    def refresh(self, root: Path = settings.Paths.root) -> dict:
+        """
+        updates the catalog with the projects in root, returns the number of
+        new, changed and removed projects (a changed status counts as a
+        changed project)
+        """
+        counts = {'new': 0, 'changed': 0, 'removed': 0}
+
+        names = set()
+        with os.scandir(root) as entries:
+            for entry in entries:
+                if not entry.name.startswith('project') or \
+                        not entry.is_dir():
+                    continue
+                names.add(entry.name)
+
+                # only probe new or changed projects
+                mtime = entry.stat().st_mtime_ns
+                project = self.projects.get(entry.name)
+                if project is not None and project['mtime'] == mtime:
+                    # the e-fields are files of the project folder itself,
+                    # such that only the results can have changed
+                    if project['status'] == NO_RESULTS:
+                        continue
+                    status = _results_status(Path(entry.path))
+                    if status != project['status']:
+                        project['status'] = status
+                        counts['changed'] += 1
+                    continue
+                counts['new' if project is None else 'changed'] += 1
+                self.projects[entry.name] = _probe(
+                    Path(entry.path), mtime, project)
+
+        for name in list(self.projects):
+            if name not in names:
+                del self.projects[name]
+                counts['removed'] += 1
+
+        return counts
+
+    def entry(self, path_project: Path) -> dict:
+        """
+        catalog entry of the project, probed if it isn't in the catalog
+        """
+        project = self.projects.get(path_project.name)
+        if project is None:
+            project = _probe(path_project, path_project.stat().st_mtime_ns)
+        return project
+
+    def select(self, status: str = None) -> List[Path]:
+        """
+        sorted paths of the projects, optionally only those with the status
+        """
+        return [Path(self.projects[name]['path'])
+                for name in sorted(self.projects)
+                if status is None or self.projects[name]['status'] == status]
+
+    def save(self) -> None:
+        write_json(self.path, {'projects': self.projects})
+
+
+def _probe(path_project: Path, mtime: int, previous: dict = None) -> dict:
+    paths_efield = sorted(path_project.glob('e-field*.csv'))
+    previous = previous if previous is not None else {}
+
+    # the grid and entities of the previous probe, if their file is the same
+    grid, grid_source = None, None
+    if len(paths_efield) != 0:
+        grid_source = _source(paths_efield[0])
+        if previous.get('grid_source') == grid_source:
+            grid = previous['grid']
+        else:
+            grid = list(source_grid_shape(paths_efield[0]))
+
+    path_dxf = path_project.joinpath('model2d.dxf')
+    dxf_entities, dxf_source = 0, None
+    if path_dxf.exists():
+        dxf_source = _source(path_dxf)
+        if previous.get('dxf_source') == dxf_source:
+            dxf_entities = previous['dxf_entities']
+        else:
+            dxf_entities = count_entities(path_dxf)
+
+    return {
+        'path': str(path_project),
+        'mtime': mtime,
+        'n_antennas': len(paths_efield),
+        'csv_bytes': [path.stat().st_size for path in paths_efield],
+        'grid': grid,
+        'grid_source': grid_source,
+        'dxf_entities': dxf_entities,
+        'dxf_source': dxf_source,
+        'status': _status(path_project)
+    }
+
+
+def _status(path_project: Path) -> str:
+    if not path_project.joinpath('e-field 11.csv').exists():
+        return NO_RESULTS
+    return _results_status(path_project)
+
+
+def _results_status(path_project: Path) -> str:
+    # status of a project with results
+    if path_project.joinpath('sar', 'configuration.json').exists():
+        return PROCESSED
+    return UNPROCESSED
+
+
+def _source(path: Path) -> list:
+    # identifies the version of a file, [name, size, modification time]
+    stat = path.stat()
+    return [path.name, stat.st_size, stat.st_mtime_ns]
@@ -1,74 +1,532 @@
 import json
+from collections import deque
+from concurrent.futures import ThreadPoolExecutor
+from functools import lru_cache
+from itertools import islice
 from pathlib import Path
-from typing import List
+from time import time
+from typing import Callable, Iterator, List, Optional, Tuple
 
 import numpy as np
 
 import settings as settings
+from .buffers import BufferPool
 from .complex_field_per_antenna import ComplexFieldPerAntenna
-from .drawing_interchange_format import DrawingInterchangeFormat
+from .cost_model import CostModel
+from .drawing_interchange_format import DrawingInterchangeFormat, \
+    domain_mask, load_maps
+from .field_bounds import FieldBounds
+from .heartbeat import Heartbeat
 from .mean_squared_field import MeanSquareField
 from .print import Print
+from .project_catalog import ProjectCatalog
+from .sample_pool import SamplePool
 from .specific_absorption_rate import SpecificAbsorptionRate
+from .stages import Stage, StageRecord
 
 
-def postprocess_project(print_: Print.log, path_project: Path) -> None:
+class _Project:
+    """
+    The stages of a project and their inputs. The inputs are only loaded once
+    a stage needs them, or in advance by prefetch.
+
+    The large arrays of the project are placed in buffers acquired from
+    buffer_pool (if given), which are returned by release once the project
+    is processed.
+
+    A project is only used by one thread at a time (the prefetching thread,
+    then the main thread), so the inputs are loaded without locking.
+    """
+
+    def __init__(
+            self,
+            path_project: Path,
+            names: List[str] = None,
+            buffer_pool: BufferPool = None
+    ):
+        self.path = path_project
+        self.print_ = print
+        self.heartbeat = None
+        self.pool = None
+        self.msf = None
+        self._materials = None
+        self._dxf = None
+        self._cfa = None
+        self.seconds_load = 0.  # loading the inputs in advance (prefetch)
+        self.buffer_pool = buffer_pool
+        self.buffers = None
+        if buffer_pool is not None:
+            self.buffers = buffer_pool.acquire()
+
+        # determine which stages need to be (re)run
+        self.has_results = path_project.joinpath('e-field 11.csv').exists()
+        self.stages = _stages()
+        self.record = StageRecord(path_project)
+        self.outdated = {}
+        if self.has_results:
+            self.outdated = self.record.outdated(self.stages)
+        if names is not None:
+            self.stages = _select_stages(self.stages, names, self.outdated)
+
+    @property
+    def materials(self) -> list:
+        if self._materials is None:
+            with open(self.path.joinpath('materials.json'), 'r') as file:
+                self._materials = json.load(file)
+        return self._materials
+
+    @property
+    def dxf(self) -> DrawingInterchangeFormat:
+        if self._dxf is None:
+            self._dxf = DrawingInterchangeFormat(self.path, self.materials)
+        return self._dxf
+
+    @property
+    def cfa(self) -> ComplexFieldPerAntenna:
+        if self._cfa is None:
+            self._cfa = ComplexFieldPerAntenna(self.path, self.buffers)
+        return self._cfa
+
+    def prefetch(self):
+        """
+        loads the inputs of the outdated stages
+        """
+        timer = time()
+        for stage in self.stages:
+            if stage.name in self.outdated:
+                for name in stage.loads:
+                    getattr(self, name)
+        self.seconds_load = time() - timer
+        return self
+
+    def release(self) -> None:
+        """
+        returns the buffers to the pool, the arrays of the project can't be
+        used anymore
+        """
+        if self.buffers is not None:
+            self.buffer_pool.release(self.buffers)
+            self.buffers = None
+        self.msf = None
+        self._cfa = None
+
+    def beat(self, n_samples: int = 1, n_bytes: int = 0) -> None:
+        """
+        reports progress to the heartbeat of the job (if any)
+        """
+        if self.heartbeat is not None:
+            self.heartbeat.add(n_samples, n_bytes)
+
+    def msf_samples(self) -> MeanSquareField:
+        """
+        msf object with the samples of this run, or else of a previous run
+        """
+        if self.msf is None:
+            self.msf = MeanSquareField(self.path, None, self.print_)
+            self.msf.load_samples()
+        return self.msf
+
+
+def postprocess_project(
+        print_: Print.log,
+        path_project: Path,
+        dry_run: bool = False,
+        names: List[str] = None,
+        project: _Project = None,
+        heartbeat: Heartbeat = None,
+        pool: SamplePool = None,
+        buffer_pool: BufferPool = None
+) -> None:
     """
     Converts the data generated in CST to 2D maps
+
+    Only the stages whose inputs (files, settings or code) changed since the
+    previous run are executed, optionally limited to the stages in names
+    (e.g. ['maps', 'bounds'] to calibrate the dB ranges before sampling),
+    together with the outdated stages they depend on. If dry_run is True,
+    the stages that would be executed are only logged.
+
+    project is the (prefetched) project as yielded by prefetch_projects, the
+    progress of the sample loops is reported to heartbeat. The samples are
+    processed by the worker processes of pool, or serially if it is None.
+    The large arrays are placed in buffers of buffer_pool (if given), which
+    are released once the project is processed.
     """
+    if project is None:
+        project = _Project(path_project, names, buffer_pool)
+    try:
+        _postprocess_project(print_, project, dry_run, heartbeat, pool)
+    finally:
+        project.release()
+
+
+def _postprocess_project(
+        print_: Print.log,
+        project: _Project,
+        dry_run: bool,
+        heartbeat: Heartbeat,
+        pool: SamplePool
+) -> None:
+    project.print_ = print_
+    project.heartbeat = heartbeat
+    project.pool = pool if pool is not None else SamplePool(n_workers=1)
+    stages, record, outdated = project.stages, project.record, project.outdated
+
     # return if results don't exist
-    if not path_project.joinpath('e-field 11.csv').exists():
+    if not project.has_results:
         print_('\t...no simulation results present')
         return
 
-    # load materials
-    with open(path_project.joinpath('materials.json'), 'r') as file:
-        materials = json.load(file)
+    # the inputs of the outdated stages are loaded (if they weren't loaded
+    # in advance) by the first stage that uses them
+    loads = any(stage.loads for stage in stages if stage.name in outdated)
+
+    # only log the stages that would be executed
+    if dry_run:
+        seconds_total, unknown = 0., False
+        if loads and record.load is not None:
+            seconds_total += record.load
+        for stage in stages:
+            if stage.name not in outdated:
+                print_('\t%s: up to date' % stage.name)
+                continue
+            seconds = record.seconds(stage.name)
+            if seconds is None:
+                print_('\t%s: recompute (not run before)' % stage.name)
+                unknown = True
+            else:
+                print_('\t%s: recompute (~%.1f s)' % (stage.name, seconds))
+                seconds_total += seconds
+
+        # stages that never ran are estimated from the project metadata,
+        # the cost model estimates all stages of the project
+        if unknown:
+            model, catalog = _cost_model()
+            seconds_total = max(seconds_total,
+                                model.runtime(catalog.entry(project.path)))
+            print_('\testimated cost: %.1f s (cost model)' % seconds_total)
+        else:
+            print_('\testimated cost: %.1f s' % seconds_total)
+        return
+
+    # run stages
+    if heartbeat is not None:
+        heartbeat.expect(settings.MSF.n * sum(
+            stage.name in outdated and stage.name in _SAMPLE_STAGES
+            for stage in stages))
+    for stage in stages:
+        if stage.name not in outdated:
+            print_('\t%s: up to date' % stage.name)
+            continue
+        timer = time()
+        if heartbeat is not None:
+            heartbeat.start_stage(stage.name, stage.name in _SAMPLE_STAGES)
+        stage.run(project)
+        if heartbeat is not None:
+            heartbeat.end_stage()
+        record.set(stage.name, outdated[stage.name], time() - timer,
+                   project.pool.memory_workers, project.pool.n_workers)
+    if loads:
+        record.set_load(project.seconds_load)
+
+
+def prefetch_projects(
+        paths_project: List[Path],
+        names: List[str] = None,
+        depth: int = settings.Prefetch.depth,
+        buffer_pool: BufferPool = None
+) -> Iterator[Tuple[Path, Optional[_Project]]]:
+    """
+    Yields (path_project, project), while the inputs of the next 'depth'
+    projects are read and parsed in background threads. At most 'depth'
+    prefetched projects are held in memory besides the yielded one.
+
+    If prefetching a project fails, None is yielded instead, such that the
+    error is raised again by postprocess_project (on the main thread).
+    """
+    if depth == 0:
+        for path_project in paths_project:
+            yield path_project, None
+        return
+
+    with ThreadPoolExecutor(max_workers=depth) as executor:
+        paths = iter(paths_project)
+        queue = deque()
+        for path_project in islice(paths, depth):
+            queue.append((path_project, executor.submit(
+                _prefetch, path_project, names, buffer_pool)))
+
+        while queue:
+            path_project, future = queue.popleft()
+            project = future.result()
+
+            # start prefetching the next project
+            for path_next in islice(paths, 1):
+                queue.append((path_next, executor.submit(
+                    _prefetch, path_next, names, buffer_pool)))
+
+            yield path_project, project
+
+
+def _prefetch(
+        path_project: Path,
+        names: List[str],
+        buffer_pool: BufferPool
+) -> Optional[_Project]:
+    project = None
+    try:
+        project = _Project(path_project, names, buffer_pool)
+        return project.prefetch()
+    except Exception:
+        if project is not None:
+            project.release()
+        return None
 
-    # load dxf object of the project, which is used to create the maps
-    dxf = DrawingInterchangeFormat(path_project, materials)
 
-    # create cfa object
-    cfa = ComplexFieldPerAntenna(path_project)
+# stages that loop over all samples
+_SAMPLE_STAGES = ['msf', 'msf_img', 'sar']
 
+
+def _select_stages(
+        stages: List[Stage],
+        names: List[str],
+        outdated: dict
+) -> List[Stage]:
+    # the given stages and the outdated stages they (indirectly) depend on,
+    # such that a stage never uses missing or outdated outputs
+    unknown = set(names) - set(stage.name for stage in stages)
+    if len(unknown) != 0:
+        raise Exception('ERROR: unknown stages %s' %
+                        ', '.join(sorted(unknown)))
+    names = set(names)
+    for stage in reversed(stages):
+        if stage.name in names:
+            names.update(name for name in stage.depends if name in outdated)
+    return [stage for stage in stages if stage.name in names]
+
+
+@lru_cache()
+def _cost_model() -> Tuple[CostModel, ProjectCatalog]:
+    # calibrated once per process, as it reads the records of many projects
+    catalog = ProjectCatalog()
+    model = CostModel()
+    model.fit(catalog)
+    return model, catalog
+
+
+def _stages() -> List[Stage]:
+    n = settings.MSF.n - 1
+    return [
+        Stage(
+            'maps', _run_maps,
+            loads=['dxf', 'cfa'],
+            files=['model2d.dxf', 'materials.json', 'e-field*.csv'],
+            settings_=[('Img', None), ('DXF', None)],
+            version=1,
+            outputs=['maps/model.png', 'maps/permittivity.png',
+                     'maps/conductivity.png', 'maps/density.png',
+                     'maps/conductivity.npy', 'maps/density.npy']
+        ),
+        Stage(
+            'bounds', _run_bounds,
+            loads=['cfa'],
+            files=['e-field*.csv'],
+            settings_=[('Img', None), ('MSF', None), ('SAR', None)],
+            version=2,
+            depends=['maps'],
+            outputs=['bounds.npz']
+        ),
+        Stage(
+            'msf', _run_msf,
+            loads=['cfa'],
+            files=['e-field*.csv'],
+            settings_=[('Img', None),
+                       ('MSF', ['n', 'phase_limit', 'amplitude_limit'])],
+            version=2,
+            depends=['maps'],
+            outputs=['msf/msf.npy', 'msf/mask.npy', 'msf/configuration.json']
+        ),
+        Stage(
+            'msf_img', _run_msf_img,
+            settings_=[('MSF', ['db_min', 'db_max'])],
+            version=1,
+            depends=['msf'],
+            outputs=['msf/msf_%04i.png' % n]
+        ),
+        Stage(
+            'sar', _run_sar,
+            settings_=[('SAR', None)],
+            version=1,
+            depends=['maps', 'msf'],
+            outputs=['sar/configuration.json', 'sar/sar_%04i.png' % n]
+        ),
+    ]
+
+
+def _run_maps(project: _Project) -> None:
     # generate and save model/permittivity/conductivity/density map
-    dxf.save(cfa.mm_per_px)
+    project.print_('\tgenerating maps')
+    project.dxf.save(project.cfa.mm_per_px)
 
-    # create msf object from cfa
-    msf = MeanSquareField(path_project, cfa, print_)
 
-    # create sar object
-    sar = SpecificAbsorptionRate(print_)
-
-    # iteratively generate a msf map with random phases/amplitudes and save it
-    pct = 0
-    pct_step = 10
-    print_('\tgenerating MSF maps (%i)' % settings.MSF.n)
-    for idx in range(settings.MSF.n):
-        # log
-        if idx / settings.MSF.n > 0.01 * pct:
-            print_('\t\t%i%%' % pct)
-            pct += pct_step
-        # generate msf and save it
-        msf.generate_msf(idx).save_map()
-        sar.generate_sar(msf, dxf.map_den, dxf.map_con).save_map()
-
-    # log
-    print_('\t\t100%')
-    print_('\tMSF range = [%f, %f]' % (msf.min, msf.max))
-    print_('\tSAR range = [%f, %f]' % (sar.min, sar.max))
-
-    # save msf configuration (filenames, phases & amplitudes)
-    print_('\tsaving msf/sar configurations')
+def _run_bounds(project: _Project) -> None:
+    # analytic msf/sar upper bounds, available before any sample is generated
+    project.print_('\tcalculating MSF/SAR bounds')
+    bounds = FieldBounds(project.cfa, *load_maps(project.path))
+    bounds.save(project.path.joinpath('bounds.npz'))
+    bounds.log(project.print_)
+
+
+def _run_msf(project: _Project) -> None:
+    # create msf object from cfa, for the pixels inside the domain only
+    map_den, _ = load_maps(project.path)
+    msf = MeanSquareField(project.path, project.cfa, project.print_,
+                          domain_mask(map_den), project.buffers)
+
+    # generate a msf for each of the random phases/amplitudes
+    project.print_('\tgenerating MSF samples (%i)' % settings.MSF.n)
+    msf.generate_configurations()
+    _run_blocks(project, _msf_block, msf.arrays(), outputs=['samples'])
+
+    # save raw msf and configurations (filenames, phases & amplitudes)
+    project.print_('\tsaving msf samples/configurations')
+    project.beat(0, msf.save_samples())
     msf.save_configurations()
+    project.msf = msf
+
+
+def _run_msf_img(project: _Project) -> None:
+    msf = project.msf_samples()
+
+    # quantize each msf sample and save it
+    project.print_('\tgenerating MSF maps (%i)' % settings.MSF.n)
+    arrays = {'samples': msf.samples, 'mask': msf.mask}
+    for result in _run_blocks(project, _msf_img_block, arrays):
+        msf.min = min(msf.min, result['min'])
+        msf.max = max(msf.max, result['max'])
+    project.print_('\tMSF range = [%f, %f]' % (msf.min, msf.max))
+
+
+def _run_sar(project: _Project) -> None:
+    msf = project.msf_samples()
+    map_den, map_con = load_maps(project.path)
+
+    # create sar object
+    sar = SpecificAbsorptionRate(project.print_)
+
+    # calculate the sar of each msf sample and save it
+    project.print_('\tgenerating SAR maps (%i)' % settings.MSF.n)
+    arrays = {'samples': msf.samples, 'mask': msf.mask,
+              'map_den': map_den, 'map_con': map_con}
+    for result in _run_blocks(project, _sar_block, arrays):
+        sar.min = min(sar.min, result['min'])
+        sar.max = max(sar.max, result['max'])
+    project.print_('\tSAR range = [%f, %f]' % (sar.min, sar.max))
+
+    # save sar configuration, note that this alters the msf configurations
+    project.print_('\tsaving sar configurations')
+    sar.msf = msf
     sar.save_configurations(msf)
+    project.msf = None
+
+
+def _run_blocks(
+        project: _Project,
+        fn: Callable,
+        arrays: dict,
+        outputs: List[str] = (),
+        pct_step: int = 10
+) -> List[dict]:
+    """
+    Runs the block function fn over all samples with the sample pool of the
+    project. The messages of each block are logged in order of the samples,
+    together with the progress (each time another pct_step percent of the
+    samples is done).
+    """
+    n = settings.MSF.n
+    results, pct = [], 0
+    args = (str(project.path),)
+    for lo, hi, result in project.pool.run(fn, arrays, args, n, outputs):
+        for msg in result['messages']:
+            project.print_(msg)
+        project.beat(hi - lo, result['n_bytes'])
+        if 100 * hi // n >= pct + pct_step:
+            pct = 100 * hi // n // pct_step * pct_step
+            project.print_('\t\t%i%%' % pct)
+        results.append(result)
+    return results
+
+
+def _msf_block(arrays: dict, args: tuple, lo: int, hi: int) -> dict:
+    msf = MeanSquareField(Path(args[0]), None, None).set_arrays(arrays)
+    for idx in range(lo, hi):
+        msf.generate_msf(idx)
+    return {'n_bytes': 0, 'messages': []}
 
 
-def get_project_paths(job_id: int, n_jobs: int) -> List[Path]:
+def _msf_img_block(arrays: dict, args: tuple, lo: int, hi: int) -> dict:
+    messages = []
+    msf = MeanSquareField(Path(args[0]), None, messages.append)
+    msf.set_arrays(arrays)
+    n_bytes = 0
+    for idx in range(lo, hi):
+        n_bytes += msf.select(idx).save_map()
+    return {'min': msf.min, 'max': msf.max, 'n_bytes': n_bytes,
+            'messages': messages}
+
+
+def _sar_block(arrays: dict, args: tuple, lo: int, hi: int) -> dict:
+    messages = []
+    msf = MeanSquareField(Path(args[0]), None, None)
+    msf.set_arrays({'samples': arrays['samples'], 'mask': arrays['mask']})
+    sar = SpecificAbsorptionRate(messages.append)
+    n_bytes = 0
+    for idx in range(lo, hi):
+        sar.generate_sar(msf.select(idx), arrays['map_den'],
+                         arrays['map_con'])
+        n_bytes += sar.save_map()
+    return {'min': sar.min, 'max': sar.max, 'n_bytes': n_bytes,
+            'messages': messages}
+
+
+def get_project_paths(
+        job_id: int,
+        n_jobs: int,
+        status: str = None,
+        plan: bool = False
+) -> List[Path]:
+    """
+    Projects that the job should process. If a status is given, these are
+    selected from the project catalog, otherwise the root is globbed. If
+    plan is True, the projects are those assigned to the job by plan.py.
+
+    The jobs only read the catalog, it's refreshed once before the jobs are
+    submitted (catalog.py, see server.sh), such that all jobs split the
+    same list of projects.
+    """
+    # projects assigned by the plan
+    if plan:
+        if status is not None:
+            raise Exception('ERROR: the projects of a plan are already '
+                            'selected by status, status can\'t be given')
+        with open(settings.Plan.path, 'r') as file:
+            jobs = json.load(file)['jobs']
+        if len(jobs) != n_jobs:
+            raise Exception('ERROR: the plan has %i jobs, not %i' %
+                            (len(jobs), n_jobs))
+        return sorted(Path(path) for path in jobs[job_id]['projects'])
+
     # obtain all the projects folders
-    paths_all_projects = np.array(list(
-        Path(settings.Paths.root).glob('project*')
-    ))
+    if status is not None:
+        catalog = ProjectCatalog()
+        if not catalog.path.exists():
+            raise Exception('ERROR: no project catalog %s, run catalog.py '
+                            'first' % catalog.path)
+        paths_all_projects = np.array(catalog.select(status))
+    else:
+        paths_all_projects = np.array(list(
+            Path(settings.Paths.root).glob('project*')
+        ))
 
     # determine the projects that the current job should process
     ids_all = np.arange(len(paths_all_projects))
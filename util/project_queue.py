@@ -0,0 +1,165 @@
+from contextlib import contextmanager
+from pathlib import Path
+from time import sleep, time
+from typing import Iterator, List, Optional
+
+import settings
+
+# file locking is only available on linux, on windows a single worker is
+# assumed
+try:
+    import fcntl
+except ImportError:
+    fcntl = None
+
+
+class ProjectQueue:
+    """
+    Queue of project paths in a local text file (one path per line), from
+    which one or more long running workers take their projects (see
+    main.py --queue). The file is locked while it (or one of its claimed
+    and failed files) is read or changed, such that each project is taken
+    by a single worker.
+
+    A taken project is claimed by the worker (a line 'worker<TAB>path' in
+    the file path.claimed) until it is done, such that the projects of a
+    worker that died can be put back with requeue. Projects that failed
+    are moved to path.failed.
+
+    Iterating over the queue takes its projects until it is empty, batches
+    keeps doing so until no projects are added for settings.Worker.idle
+    seconds.
+    """
+
+    def __init__(self, path: Path = settings.Worker.queue, worker: str = '0'):
+        self.path = Path(path)
+        self.path_claimed = Path(str(path) + '.claimed')
+        self.path_failed = Path(str(path) + '.failed')
+        self.worker = worker
+        self.n_taken = 0  # number of projects taken by this process
+
+    def put(self, paths: List[Path]) -> None:
+        with self._locked() as file:
+            for path in paths:
+                file.write(str(path) + '\n')
+
+    def pop(self) -> Optional[Path]:
+        """
+        takes and claims the first project, None if the queue is empty
+        """
+        with self._locked() as file:
+            file.seek(0)
+            lines = [line for line in file.read().splitlines() if line]
+            if len(lines) == 0:
+                return None
+            claims = _read(self.path_claimed)
+            _write(self.path_claimed, claims + [self._claim(lines[0])])
+            file.truncate(0)
+            file.writelines(line + '\n' for line in lines[1:])
+        self.n_taken += 1
+        return Path(lines[0])
+
+    def done(self, path: Path, failed: bool = False) -> None:
+        """
+        releases the claim of a project, which is kept in path.failed if
+        it failed
+        """
+        claim = self._claim(path)
+        with self._locked():
+            claims = _read(self.path_claimed)
+            if claim in claims:
+                claims.remove(claim)
+            _write(self.path_claimed, claims)
+            if failed:
+                _write(self.path_failed, _read(self.path_failed) + [claim])
+
+    def requeue(self, any_worker: bool = False) -> int:
+        """
+        puts the claimed projects of this worker (or of any worker) back in
+        front of the queue, returns the number of projects
+        """
+        with self._locked() as file:
+            claims = _read(self.path_claimed)
+            requeued = [claim for claim in claims if any_worker or
+                        claim.split('\t', 1)[0] == self.worker]
+            if len(requeued) == 0:
+                return 0
+            _write(self.path_claimed,
+                   [claim for claim in claims if claim not in requeued])
+            file.seek(0)
+            lines = [line for line in file.read().splitlines() if line]
+            file.truncate(0)
+            file.writelines(claim.split('\t', 1)[1] + '\n'
+                            for claim in requeued)
+            file.writelines(line + '\n' for line in lines)
+        return len(requeued)
+
+    def failed(self) -> List[Path]:
+        """
+        takes the projects that failed (see done)
+        """
+        with self._locked():
+            claims = _read(self.path_failed)
+            _write(self.path_failed, [])
+        return [Path(claim.split('\t', 1)[1]) for claim in claims]
+
+    def __len__(self) -> int:
+        with self._locked() as file:
+            file.seek(0)
+            return sum(1 for line in file.read().splitlines() if line)
+
+    def __iter__(self) -> Iterator[Path]:
+        path = self.pop()
+        while path is not None:
+            yield path
+            path = self.pop()
+
+    def batches(self) -> Iterator[Iterator[Path]]:
+        """
+        Yields the queue each time it contains projects, stops once it is
+        empty for settings.Worker.idle seconds
+        """
+        while self.wait():
+            yield iter(self)
+
+    def wait(self) -> bool:
+        """
+        waits until the queue contains projects, False if it remains empty
+        for settings.Worker.idle seconds
+        """
+        timer = time()
+        while len(self) == 0:
+            if time() - timer > settings.Worker.idle:
+                return False
+            sleep(settings.Worker.poll)
+        return True
+
+    def _claim(self, path: Path) -> str:
+        return '%s\t%s' % (self.worker, path)
+
+    @contextmanager
+    def _locked(self):
+        # append mode creates the file if it doesn't exist yet
+        with open(self.path, 'a+') as file:
+            if fcntl is not None:
+                fcntl.flock(file, fcntl.LOCK_EX)
+            try:
+                yield file
+            finally:
+                file.flush()
+                if fcntl is not None:
+                    fcntl.flock(file, fcntl.LOCK_UN)
+
+
+def _read(path: Path) -> List[str]:
+    # lines of a file of the queue, must be called while it's locked
+    if not path.exists():
+        return []
+    with open(path) as file:
+        return [line for line in file.read().splitlines() if line]
+
+
+def _write(path: Path, lines: List[str]) -> None:
+    # must be called while the queue is locked
+    with open(path, 'w') as file:
+        file.writelines(line + '\n' for line in lines)
@@ -0,0 +1,128 @@
+import multiprocessing
+import os
+from multiprocessing import resource_tracker
+from multiprocessing.shared_memory import SharedMemory
+from typing import Callable, Iterator, List, Tuple
+
+import numpy as np
+
+import settings
+from .stages import peak_memory
+
+
+class SamplePool:
+    """
+    Splits the samples of a stage into blocks of settings.Parallel.block_size
+    samples, which are processed by settings.Parallel.n_workers worker
+    processes.
+
+    The arrays of a run are placed once in shared memory, the workers attach
+    them without copying. A block function fn(arrays, args, lo, hi) processes
+    the samples lo..hi, it may write into the arrays and returns a (small,
+    picklable) result. The results are yielded in order of the blocks, such
+    that merging them gives the same outcome as a serial run.
+
+    The workers are forked once, when the pool is created, which should be
+    done before any other threads (e.g. prefetching) are started. Forking is
+    not available on windows, where the blocks are processed serially.
+
+    The workers report their peak memory with each block, memory_workers
+    is the largest peak (bytes) of a single worker so far, None if there
+    are no workers or it is unknown.
+    """
+
+    def __init__(self, n_workers: int = settings.Parallel.n_workers):
+        self.n_workers = n_workers if os.name != 'nt' else 1
+        self._pool = None
+        self.memory_workers = None
+        if self.n_workers > 1:
+            # the workers must share the resource tracker of this process,
+            # otherwise they would clean up the shared memory on exit
+            resource_tracker.ensure_running()
+            self._pool = multiprocessing.get_context('fork').Pool(
+                self.n_workers)
+
+    def run(
+            self,
+            fn: Callable,
+            arrays: dict,
+            args: tuple,
+            n: int,
+            outputs: List[str] = ()
+    ) -> Iterator[Tuple[int, int, object]]:
+        """
+        Yields (lo, hi, result) of each block, the arrays in outputs contain
+        the values written by the workers once all blocks are yielded
+        """
+        block_size = settings.Parallel.block_size
+        blocks = [(lo, min(lo + block_size, n))
+                  for lo in range(0, n, block_size)]
+
+        # process the blocks in this process
+        if self._pool is None:
+            for lo, hi in blocks:
+                yield lo, hi, fn(arrays, args, lo, hi)
+            return
+
+        # place arrays in shared memory
+        shared, specs = {}, {}
+        try:
+            for name, array in arrays.items():
+                shm = SharedMemory(create=True, size=max(1, array.nbytes))
+                shared[name] = shm
+                np.ndarray(array.shape, array.dtype, buffer=shm.buf)[...] = \
+                    array
+                specs[name] = (shm.name, array.shape, array.dtype.str)
+
+            tasks = [(fn, specs, args, lo, hi) for lo, hi in blocks]
+            results = self._pool.imap(_run_block, tasks)
+            for (lo, hi), (result, memory) in zip(blocks, results):
+                if memory is not None:
+                    self.memory_workers = max(self.memory_workers or 0,
+                                              memory)
+                yield lo, hi, result
+
+            # copy the values written by the workers
+            for name in outputs:
+                arrays[name][...] = np.ndarray(
+                    arrays[name].shape,
+                    arrays[name].dtype,
+                    buffer=shared[name].buf
+                )
+        finally:
+            for shm in shared.values():
+                shm.close()
+                shm.unlink()
+
+    def close(self) -> None:
+        if self._pool is not None:
+            self._pool.close()
+            self._pool.join()
+            self._pool = None
+
+
+# shared memory attached by this (worker) process, {name: (shm, array)}
+_attached = {}
+
+
+def _run_block(task):
+    fn, specs, args, lo, hi = task
+
+    # detach the shared memory of previous runs
+    names = [spec[0] for spec in specs.values()]
+    for name in list(_attached):
+        if name not in names:
+            shm, array = _attached.pop(name)
+            del array
+            shm.close()
+
+    arrays = {key: _attach(*spec) for key, spec in specs.items()}
+    result = fn(arrays, args, lo, hi)
+    return result, peak_memory()
+
+
+def _attach(name: str, shape: tuple, dtype: str) -> np.ndarray:
+    if name not in _attached:
+        shm = SharedMemory(name=name)
+        _attached[name] = (shm, np.ndarray(shape, dtype, buffer=shm.buf))
+    return _attached[name][1]
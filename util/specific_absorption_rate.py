@@ -5,11 +5,16 @@ import cv2
 import numpy as np
 
 import settings
-from .mean_squared_field import MeanSquareField
+from .mean_squared_field import MeanSquareField, scatter
 from .print import Print
 
 
 class SpecificAbsorptionRate:
+    """
+    Calculates the Specific Absorption Rate (sar) from the msf, for the
+    active pixels of the msf only (packed, see MeanSquareField).
+    """
+
     def __init__(self, print_: Print.log):
         self.print_ = print_
         self.sar = None
@@ -25,25 +30,34 @@ class SpecificAbsorptionRate:
     ):
         delta = 1e-20
         self.msf = msf_obj
-        img_shape = (settings.Img.width, settings.Img.height)
-        self.sar = msf_obj.msf.reshape(img_shape) * map_conductivity / (
-                map_density + delta)
+        mask = msf_obj.mask
+        self.sar = msf_obj.msf * map_conductivity.reshape(-1)[mask] / (
+                map_density.reshape(-1)[mask] + delta)
         return self
 
-    def save_map(self):
+    def save_map(self) -> int:
         folder = str(self.msf.folder).replace('msf', 'sar')
         filename = self.msf.filename.replace('msf', 'sar')
         if not Path(folder).exists():
-            Path(folder).mkdir()
+            Path(folder).mkdir(exist_ok=True)
 
-        cv2.imwrite(filename, self.to_img())
+        # write image, returns the number of bytes written
+        _, buffer = cv2.imencode('.png', self.to_img())
+        with open(filename, 'wb') as file:
+            file.write(buffer)
+        return len(buffer)
 
     def to_img(self) -> np.ndarray:
         delta = 1e-20
 
-        # use db scale
+        # use db scale, sar only contains the active pixels
         sar = 10 * np.log10(self.sar + delta)
 
+        # return an empty image if there are no active pixels
+        if len(sar) == 0:
+            img_shape = (settings.Img.width, settings.Img.height)
+            return np.zeros(img_shape, np.uint8)
+
         # save max sar value
         if np.max(sar) > self.max:
             self.max = np.max(sar)
@@ -74,7 +88,7 @@ class SpecificAbsorptionRate:
         sar = 255 * (sar - settings.SAR.db_min) / a
 
         # return sar as image
-        return sar.astype(np.uint8)
+        return scatter(sar.astype(np.uint8), self.msf.mask)
 
     def save_configurations(self, msf):
         # get path by modifying path of msf
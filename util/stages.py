@@ -0,0 +1,202 @@
+import hashlib
+import json
+from pathlib import Path
+from typing import Callable, Dict, List, Tuple
+
+import settings
+
+class Stage:
+    """
+    A single step of the post-processing pipeline, together with its
+    declared inputs:
+        files:      glob patterns relative to the project folder
+        settings_:  (section, attributes) of settings.py, attributes=None
+                    means the whole section
+        version:    version of the implementation of the stage, which must
+                    be incremented when a change of the code changes its
+                    outputs (other changes of the code don't rerun it)
+        depends:    names of the stages whose outputs are used
+        outputs:    files (relative to the project folder) that the stage
+                    produces, the stage is rerun if any of them is missing
+        loads:      inputs of the project (e.g. 'cfa') that the stage uses,
+                    these are loaded in advance when prefetching
+    """
+
+    def __init__(
+            self,
+            name: str,
+            run: Callable,
+            files: List[str] = (),
+            settings_: List[Tuple[str, List[str]]] = (),
+            version: int = 1,
+            depends: List[str] = (),
+            outputs: List[str] = (),
+            loads: List[str] = ()
+    ):
+        self.name = name
+        self.run = run
+        self.files = files
+        self.settings_ = settings_
+        self.version = version
+        self.depends = depends
+        self.outputs = outputs
+        self.loads = loads
+
+
+class StageRecord:
+    """
+    Keeps track of the input hashes, durations and peak memory of the
+    stages of a project, and the duration of loading its inputs in advance
+    (prefetching), which are stored in 'stages.json' in the project folder.
+
+    Content hashes of the input files are cached by size and modification
+    time, such that (large) files are only read again when they changed.
+    """
+
+    def __init__(self, path_project: Path):
+        self.path_project = path_project
+        self.path = path_project.joinpath('stages.json')
+        self.stages = {}
+        self.files = {}
+        self.load = None
+        if self.path.exists():
+            with open(self.path, 'r') as file:
+                record = json.load(file)
+            self.stages = record['stages']
+            self.files = record['files']
+            self.load = record['load']
+
+    def outdated(self, stages: List[Stage]) -> Dict[str, str]:
+        """
+        Returns {name: input hash} of each stage that needs to be (re)run.
+        Stages must be given in order of execution.
+        """
+        hashes, outdated = {}, {}
+        for stage in stages:
+            hashes[stage.name] = self._input_hash(stage, hashes)
+            previous = self.stages.get(stage.name, {}).get('hash')
+            if previous != hashes[stage.name] or \
+                    any(name in outdated for name in stage.depends) or \
+                    not all(self.path_project.joinpath(output).exists()
+                            for output in stage.outputs):
+                outdated[stage.name] = hashes[stage.name]
+        return outdated
+
+    def seconds(self, name: str):
+        """
+        Duration of the last run of the stage, None if it never ran
+        """
+        return self.stages.get(name, {}).get('seconds')
+
+    def memory(self, name: str):
+        """
+        Peak memory (bytes) of the process at the end of the last run of the
+        stage, None if it never ran or is unknown
+        """
+        return self.stages.get(name, {}).get('memory')
+
+    def memory_workers(self, name: str):
+        """
+        Peak memory (bytes) of a single sample worker at the end of the last
+        run of the stage and the number of workers, (None, 1) if the stage
+        ran without workers or it is unknown
+        """
+        stage = self.stages.get(name, {})
+        return stage.get('memory_workers'), stage.get('workers', 1)
+
+    def set(
+            self,
+            name: str,
+            input_hash: str,
+            seconds: float,
+            memory_workers: int = None,
+            n_workers: int = 1
+    ) -> None:
+        # the peak memory of the workers isn't included in that of this
+        # process, it's stored separately (see SamplePool.memory_workers)
+        self.stages[name] = {
+            'hash': input_hash,
+            'seconds': seconds,
+            'memory': peak_memory(),
+            'memory_workers': memory_workers,
+            'workers': n_workers
+        }
+        self.save()
+
+    def set_load(self, seconds: float) -> None:
+        """
+        sets the duration of loading the inputs in advance, which isn't
+        included in the durations of the stages that use them
+        """
+        self.load = seconds
+        self.save()
+
+    def save(self) -> None:
+        with open(self.path, 'w') as file:
+            json.dump({'stages': self.stages, 'files': self.files,
+                       'load': self.load}, file)
+
+    def _input_hash(self, stage: Stage, hashes: Dict[str, str]) -> str:
+        sha = hashlib.sha256()
+
+        # input files
+        for pattern in stage.files:
+            for path in sorted(self.path_project.glob(pattern)):
+                sha.update(path.name.encode())
+                sha.update(self._file_hash(path).encode())
+
+        # settings
+        for section, attributes in stage.settings_:
+            sha.update(_settings_repr(section, attributes).encode())
+
+        # code version
+        sha.update(('version=%i' % stage.version).encode())
+
+        # upstream stages
+        for name in stage.depends:
+            sha.update(hashes[name].encode())
+
+        return sha.hexdigest()
+
+    def _file_hash(self, path: Path) -> str:
+        stat = path.stat()
+        cached = self.files.get(path.name)
+        if cached is not None and cached['size'] == stat.st_size and \
+                cached['mtime'] == stat.st_mtime_ns:
+            return cached['sha256']
+
+        self.files[path.name] = {
+            'size': stat.st_size,
+            'mtime': stat.st_mtime_ns,
+            'sha256': _sha256(path)
+        }
+        return self.files[path.name]['sha256']
+
+
+def peak_memory():
+    """
+    Peak resident set size (bytes) of this process so far, None on windows
+    """
+    try:
+        import resource
+    except ImportError:
+        return None
+    # ru_maxrss is given in kilobytes on linux
+    return resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+
+
+def _settings_repr(section: str, attributes: List[str] = None) -> str:
+    cls = getattr(settings, section)
+    if attributes is None:
+        attributes = sorted(key for key in vars(cls)
+                            if not key.startswith('_'))
+    return ';'.join('%s.%s=%r' % (section, key, getattr(cls, key))
+                    for key in attributes)
+
+
+def _sha256(path: Path) -> str:
+    sha = hashlib.sha256()
+    with open(path, 'rb') as file:
+        for chunk in iter(lambda: file.read(2 ** 20), b''):
+            sha.update(chunk)
+    return sha.hexdigest()